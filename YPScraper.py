@@ -1,237 +1,787 @@
-import aiohttp
+if __name__ == "__main__":
+    # Run as a script: hand over to cli before anything below is imported, so
+    # command-line settings are applied first and cli imports this file once
+    # as the YPScraper module.
+    import cli
+    cli.main()
+    raise SystemExit
+
 import asyncio
-from bs4 import BeautifulSoup as bs
-import pandas as pd
 from datetime import datetime
 import os
 import logging
-from urllib.parse import urlparse, parse_qsl, quote
+from urllib.parse import urlparse, parse_qsl
 import config
+import parsers
+import http_cache
+import rate_limit
+import gallery_tiers
+import exporters
+import crawl_state
+import metrics
+import work_store
+import frontier
+import business_store
+import record_table
+import transport
+import images
+import normalize
 import time
-from tqdm import tqdm
+import importlib
+import itertools
+import signal
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-cache = {}
+cache = http_cache.MemoryCache()
+parse_pool = None
+rate_limiter = rate_limit.AdaptiveRateLimiter()
+tier_memory = gallery_tiers.GalleryTierMemory(None)
+driver_pool = None
+image_pipeline = None
+inflight = {}
+stats = metrics.Metrics()
+
+async def single_flight(key, factory):
+    # Concurrent callers asking for the same key share one underlying task.
+    # The shield keeps one caller's cancellation from failing the others.
+    task = inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(factory())
+        inflight[key] = task
+        task.add_done_callback(lambda _: inflight.pop(key, None))
+    return await asyncio.shield(task)
 
 async def cached_request(url, session):
-    if url not in cache:
+    return await single_flight(('request', url), lambda: fetch_url(url, session))
+
+async def fetch_url(url, session):
+    kind = http_cache.url_class(url)
+    entry = cache.get(url)
+    if entry is not None and entry.is_fresh(http_cache.ttl_for(url)):
+        stats.inc('cache_lookups_total', kind=kind, result='hit')
+        return entry.body
+    stats.inc('cache_lookups_total', kind=kind, result='stale' if entry is not None else 'miss')
+    headers = entry.revalidation_headers() if entry is not None else {}
+    for attempt in range(config.MAX_RETRIES + 1):
+        if attempt:
+            stats.inc('retries_total', kind=kind)
+            await asyncio.sleep(rate_limit.backoff_delay(attempt))
+        await rate_limiter.acquire(url)
+        start = time.monotonic()
+        stats.add('inflight_requests', 1)
         try:
-            async with session.get(url) as response:
-                response.raise_for_status()
-                cache[url] = await response.text()
-        except aiohttp.ClientError as e:
-            logging.error(f"Request error for URL {url}: {e}")
-            return None
-    return cache[url]
+            response = await session.get(url, headers=headers)
+            stats.inc('responses_total', kind=kind, status=response.status)
+            if response.status in config.RETRY_STATUSES:
+                retry_after = rate_limit.parse_retry_after(response.headers.get('Retry-After'))
+                rate_limiter.record_throttle(url, response.status, retry_after)
+                logging.warning(f"HTTP {response.status} for URL {url} (attempt {attempt + 1})")
+                continue
+            latency = time.monotonic() - start
+            if response.status == 304 and entry is not None:
+                rate_limiter.record_success(url, latency)
+                stats.observe('fetch_seconds', latency, kind=kind)
+                cache.touch(url)
+                return entry.body
+            if response.status >= 400:
+                # Other 4xx/5xx answers will not change on retry.
+                logging.error(f"Request error for URL {url}: HTTP {response.status}")
+                return None
+            rate_limiter.record_success(url, latency)
+            stats.observe('fetch_seconds', latency, kind=kind)
+            stats.inc('downloaded_bytes_total', response.wire_bytes, kind=kind)
+            cache.set(url, http_cache.CacheEntry(response.body, response.headers.get('ETag'),
+                                                 response.headers.get('Last-Modified')))
+            return response.body
+        except session.errors as e:
+            stats.inc('request_errors_total', kind=kind, error=type(e).__name__)
+            rate_limiter.record_error(url, e)
+            logging.warning(f"Request error for URL {url} (attempt {attempt + 1}): {e}")
+        finally:
+            stats.add('inflight_requests', -1)
+    stats.inc('requests_abandoned_total', kind=kind)
+    logging.error(f"Giving up on URL {url} after {config.MAX_RETRIES + 1} attempts")
+    return None
 
-def clear_cache():
+def init_parse_worker(settings):
+    # A worker started with 'spawn' imports config.py afresh, which loses --set
+    # overrides and patched settings like DOMAIN. Apply the parent's values and
+    # recompile the selectors parsers builds at import time.
+    for name, value in settings.items():
+        setattr(config, name, value)
+    importlib.reload(parsers)
+
+def open_parse_pool():
+    global parse_pool
+    if config.PARSE_WORKERS != 0:
+        settings = {name: value for name, value in vars(config).items() if name.isupper()}
+        parse_pool = ProcessPoolExecutor(max_workers=config.PARSE_WORKERS,
+                                         initializer=init_parse_worker, initargs=(settings,))
+
+def close_parse_pool():
+    global parse_pool
+    if parse_pool is not None:
+        parse_pool.shutdown(cancel_futures=True)
+        parse_pool = None
+
+def open_tier_memory():
+    global tier_memory
+    tier_memory = gallery_tiers.GalleryTierMemory(config.GALLERY_TIER_PATH)
+
+def open_image_pipeline():
+    global image_pipeline
+    if image_pipeline is None:
+        image_pipeline = images.ImagePipeline(rate_limiter, config.IMAGE_THUMBNAIL_SIZE)
+
+def close_image_pipeline():
+    global image_pipeline
+    if image_pipeline is not None:
+        image_pipeline.close()
+        image_pipeline = None
+
+def open_cache():
     global cache
-    cache = {}
+    cache = http_cache.open_cache(config.CACHE_BACKEND)
 
-def read_lines_from_file(file_path):
-    try:
-        with open(file_path, 'r') as file:
-            lines = [line.strip() for line in file.readlines()]
-            return lines if lines else ["No data in file"]
-    except IOError as e:
-        print(f"File error: {e}")
-        return []
-
-async def extract(url, session):
+def clear_cache():
+    cache.clear()
+
+def timed_call(func, *args):
+    start = time.perf_counter()
+    return func(*args), time.perf_counter() - start
+
+async def parse(func, *args):
+    # parse_seconds is time spent in the parser itself; parse_wait_seconds is
+    # the pool's queueing and pickling overhead on top of it.
+    start = time.perf_counter()
+    if parse_pool is None:
+        result, elapsed = timed_call(func, *args)
+    else:
+        result, elapsed = await asyncio.get_running_loop().run_in_executor(parse_pool, timed_call, func, *args)
+    stats.observe('parse_seconds', elapsed, parser=func.__name__)
+    stats.observe('parse_wait_seconds', time.perf_counter() - start - elapsed, parser=func.__name__)
+    return result
+
+async def extract(url, session, query=''):
     try:
         content = await cached_request(url, session)
         if content:
-            soup = bs(content, 'lxml')
-            return soup.find_all('div', class_='info')
+            return await parse(parsers.parse_search_page, content, query)
         else:
             logging.warning(f"No content received from URL: {url}")
-            return []
-    except aiohttp.ClientError as e:
+            return None
+    except session.errors as e:
         logging.error(f"Request error for URL {url}: {e}")
-        return []
-
-def extract_business_info(item, query):
-    business_url = f"{config.DOMAIN}{item.find('a', class_='business-name')['href']}" if item.find('a', class_='business-name') else ''
-    rank = item.find('h2', class_='n').text.split('.')[0] if item.find('h2', class_='n') else ''
-    return {
-        'name': item.find('a', class_='business-name').text if item.find('a', class_='business-name') else '',
-        'phone': item.find('div', class_='phones phone primary').text if item.find('div', class_='phones phone primary') else '',
-        'address': item.find('div', class_='adr').get_text(separator=', ') if item.find('div', class_='adr') else '',
-        'website': item.find('a', class_='track-visit-website')['href'] if item.find('a', class_='track-visit-website') else '',
-        'yp_url': business_url,
-        f"{query}_rank": rank
+        return None
+
+async def transform(listings, location, query, business_data, scheduler):
+    # Location and timestamp are the same for the whole page; interned so
+    # every record on it shares one copy of each string.
+    if ',' in location:
+        city, state = location.split(', ', 1)
+    else:
+        city, state = location, ''
+    location_fields = {
+        'city': sys.intern(city),
+        'state': sys.intern(state),
+        'search_datetime': sys.intern(datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
     }
 
-async def transform(articles, location, query, business_data, session):
-    for item in articles:
-        info = extract_business_info(item, query)
+    for listing in listings:
+        info = listing['info']
         unique_id = (info['name'], info['address'])
 
-        if ',' in location:
-            city, state = location.split(', ', 1)
-        else:
-            city, state = location, ''
-
         if unique_id in business_data:
+            # A repeat sighting only fills in or replaces values, never blanks them.
             existing_info = business_data[unique_id]
-            existing_info.update(info)
-            existing_info['city'] = city
-            existing_info['state'] = state
-            existing_info['search_datetime'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            record_table.fold_record(existing_info, info)
+            record_table.fold_record(existing_info, location_fields)
         else:
-            info.update({
-                'city': city,
-                'state': state,
-                'search_datetime': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            })
+            info.update(location_fields)
             business_data[unique_id] = info
 
-        await process_follow_links(item, unique_id, business_data, session)
+        scheduler.save(unique_id)
+        scheduler.hold(unique_id)
+        process_follow_links(listing, unique_id, scheduler)
+        scheduler.release(unique_id)
 
     return business_data
 
-async def process_follow_links(item, unique_id, business_data, session):
-    follow_links = [a['href'] for a in item.find_all('a', class_='business-name') if "#" not in a['href']]
-    for link in follow_links:
-        details_response = await cached_request(config.DOMAIN + link, session)
-        if details_response:
-            details_page = bs(details_response, "lxml")
-            update_business_details(unique_id, business_data, details_page)
-            space_image_link = await extract_space_images(details_page, session)
-            if space_image_link:
-                business_data[unique_id]['space_image'] = space_image_link
-
-async def extract_space_images(details_page, session):
-    media_thumbnail_link = details_page.find('a', class_='media-thumbnail collage-pic')
-    if media_thumbnail_link:
-        gallery_link = config.DOMAIN + media_thumbnail_link['href']
+def process_follow_links(listing, unique_id, scheduler):
+    # A business found by several queries or pages is only detailed once per run.
+    key = hash(unique_id)
+    if key in scheduler.detailed:
+        return
+    scheduler.detailed.add(key)
+    if scheduler.business_store is not None:
+        # Incremental runs reuse recent details of businesses whose listing is unchanged.
+        details = scheduler.business_store.fresh_details(unique_id, listing['info'])
+        if details is not None:
+            scheduler.business_data[unique_id].update(details)
+            scheduler.reused.add(key)
+            stats.inc('follow_ups_skipped_total')
+            return
+    for link in listing['follow_links']:
+        scheduler.follow('detail', config.DOMAIN + link, unique_id)
+
+async def fetch_details(link, session):
+    details_response = await cached_request(link, session)
+    if not details_response:
+        return None
+    return await parse(parsers.parse_detail_page, details_response)
+
+async def process_follow_link(link, unique_id, scheduler):
+    try:
+        parsed = await single_flight(('detail', link), lambda: fetch_details(link, scheduler.session))
+        if parsed is None:
+            scheduler.task_failed(link, unique_id)
+            return
+        scheduler.business_data[unique_id].update(record_table.intern_fields(parsed['details']))
+        if parsed['gallery_link']:
+            scheduler.follow('gallery', parsed['gallery_link'], unique_id)
+        scheduler.save(unique_id)
+        scheduler.task_done(link, unique_id)
+    finally:
+        scheduler.release(unique_id)
+
+async def process_gallery(gallery_link, unique_id, scheduler):
+    try:
+        space_image_link = await single_flight(('gallery', gallery_link),
+                                               lambda: extract_space_images(gallery_link, scheduler.session))
+        if space_image_link is None:
+            scheduler.task_failed(gallery_link, unique_id)
+            return
+        if space_image_link:
+            scheduler.business_data[unique_id]['space_image'] = space_image_link
+            scheduler.save(unique_id)
+            if image_pipeline is not None:
+                scheduler.follow('images', f"{gallery_link}#images", unique_id)
+        scheduler.task_done(gallery_link, unique_id)
+    finally:
+        scheduler.release(unique_id)
+
+async def process_images(link, unique_id, scheduler):
+    # Downloads the gallery images listed in space_image; the record keeps
+    # the stored paths, thumbnails and content hashes of those that arrived.
+    try:
+        record = scheduler.business_data[unique_id]
+        urls = images.image_urls(record.get('space_image'), link)
+        files = await asyncio.gather(*(
+            single_flight(('image', url), lambda url=url: image_pipeline.fetch(url, scheduler.session))
+            for url in urls))
+        for file in files:
+            stats.inc('images_total', result=file.source if file is not None else 'failed')
+        stored = [file for file in files if file is not None]
+        if urls and not stored:
+            scheduler.task_failed(link, unique_id)
+            return
+        record.update(images.image_columns(stored))
+        scheduler.save(unique_id)
+        scheduler.task_done(link, unique_id)
+    finally:
+        scheduler.release(unique_id)
+
+async def extract_space_images(gallery_link, session):
+    # Plain HTTP first; a headless browser only when the page came back without
+    # any a[data-media] images (or not at all) and GALLERY_BROWSER allows it.
+    image_urls = None
+    tried_http = config.GALLERY_BROWSER != 'always' and (
+        config.GALLERY_BROWSER == 'never' or tier_memory.should_try_http(gallery_link))
+    if tried_http:
         gallery_response = await cached_request(gallery_link, session)
         if gallery_response:
-            gallery_page = bs(gallery_response, 'lxml')
-            data_media_links = gallery_page.find_all('a', attrs={'data-media': True})
-            image_urls = [link.find('img')['src'] for link in data_media_links if link.find('img')]
-            return ', '.join(image_urls)
-    return None
+            image_urls = await parse(parsers.parse_gallery_page, gallery_response)
+        if image_urls or config.GALLERY_BROWSER == 'never':
+            if image_urls:
+                tier_memory.record(gallery_link, gallery_tiers.HTTP)
+            return image_urls
+
+    rendered = await browser_request(gallery_link)
+    if rendered is None:
+        return image_urls
+    browser_image_urls = await parse(parsers.parse_gallery_page, rendered)
+    if tried_http:
+        # Only a browser win teaches us anything; two empty results mean an empty gallery.
+        tier = gallery_tiers.BROWSER if browser_image_urls else gallery_tiers.HTTP
+        tier_memory.record(gallery_link, tier)
+    return browser_image_urls
+
+async def browser_request(url):
+    return await single_flight(('browser', url), lambda: render_url(url))
+
+async def render_url(url):
+    key = f"{url}#rendered"
+    entry = cache.get(key)
+    if entry is not None and entry.is_fresh(http_cache.ttl_for(url)):
+        return entry.body
+    pool = open_driver_pool()
+    if pool is None:
+        return None
+    await rate_limiter.acquire(url)
+    try:
+        content = await pool.fetch(url)
+    except Exception as e:
+        # WebDriverException, or chromedriver setup failing on first use.
+        logging.error(f"Browser error for URL {url}: {e}")
+        return None
+    cache.set(key, http_cache.CacheEntry(content))
+    return content
+
+def open_driver_pool():
+    # Selenium is only imported once a page actually needs a browser.
+    global driver_pool
+    if driver_pool is None and config.GALLERY_BROWSER != 'never':
+        try:
+            from driver_pool import DriverPool
+        except ImportError as e:
+            logging.warning(f"Browser tier unavailable, using plain HTTP for galleries: {e}")
+            config.GALLERY_BROWSER = 'never'
+            return None
+        driver_pool = DriverPool()
+    return driver_pool
 
-def update_business_details(unique_id, business_data, details_page):
-    additional_details = {
-        'slogan': get_text_or_none(details_page, "h2", class_="slogan"),
-        'general_info': get_text_or_none(details_page, "dd", class_="general-info"),
-        'neighborhood': get_text_or_none(details_page, "dd", class_="neighborhoods"),
-        'email': extract_email(details_page),
-        'extra_phones': get_text_or_none(details_page, "dd", class_="extra-phones", sep=' '),
-        'social_links': get_text_or_none(details_page, "dd", class_="social-links", sep=', '),
-        'categories': get_text_or_none(details_page, "dd", class_="categories"),
-        'hour_category': get_text_or_none(details_page, "span", class_="hour-category"),
-        'other_info': extract_other_info(details_page),
-        'detailed_hours': extract_detailed_hours(details_page)
-    }
-    business_data[unique_id].update(additional_details)
-
-def get_text_or_none(soup, tag, class_=None, sep=''):
-    element = soup.find(tag, class_=class_)
-    if element:
-        return element.get_text(separator=sep).strip()
-    return ''
-
-def extract_email(details_page):
-    email_element = details_page.find('a', class_='email-business')
-    return email_element.get('href').split(':')[1] if email_element else ''
-
-def extract_other_info(details_page):
-    other_info_dd = details_page.find("dd", class_="other-information")
-    if other_info_dd:
-        return ', '.join([p.get_text(separator=' ', strip=True).replace(" :", ":") 
-                          for p in other_info_dd.find_all('p') if p.get_text(strip=True)])
-    return ''
-
-def extract_detailed_hours(details_page):
-    hours_div = details_page.find('div', class_='open-details')
-    if hours_div and (hours_table := hours_div.find('table')):
-        return ', '.join([f"{row.find('th').get_text().strip()} {row.find('td').get_text().strip()}"
-                          for row in hours_table.find_all('tr') if row.find('th') and row.find('td')])
-    return ''
+async def close_driver_pool():
+    global driver_pool
+    if driver_pool is not None:
+        await driver_pool.close()
+        driver_pool = None
 
 def save_to_csv(business_data, filename):
-    base_columns = config.DFCOL_ORDER
-
+    # One columnar pass over the records instead of a DataFrame per call.
     dynamic_columns = set()
     for data in business_data.values():
         dynamic_columns.update(data.keys())
+    dynamic_columns.difference_update(config.DFCOL_ORDER)
 
-    dynamic_columns.difference_update(base_columns)
-
-    combined_columns = sorted(dynamic_columns) + base_columns
-    new_df = pd.DataFrame.from_dict(business_data, orient='index')
-    new_df = new_df.reindex(columns=combined_columns)
-
-    if not os.path.exists('exports'):
-        os.makedirs('exports')
-
-    file_path = os.path.join(config.EXPORTS_PATH, filename)
-    new_df = pd.DataFrame.from_dict(business_data, orient='index')
+    table = record_table.RecordTable(sorted(dynamic_columns) + config.DFCOL_ORDER)
+    for data in business_data.values():
+        table.add(data)
 
-    new_df = new_df.reindex(columns=combined_columns)
+    if not os.path.exists(config.EXPORTS_PATH):
+        os.makedirs(config.EXPORTS_PATH)
+    table.write_csv(os.path.join(config.EXPORTS_PATH, filename))
 
-    new_df.to_csv(file_path, index=False)
-    
 async def concurrent_extraction(urls, session):
     tasks = [asyncio.create_task(extract(url, session)) for url in urls]
     results = await asyncio.gather(*tasks)
     return zip(urls, results)
 
-def generate_urls(cities, queries, pages, domain):
-    urls = []
-    for city in cities:
-        formatted_city = quote(city)
-        for query in queries:
-            for x in range(1, pages + 1):
-                url = f'{domain}/search?search_terms={query}&geo_location_terms={formatted_city}&page={x}'
-                urls.append(url)
-    return urls
-
-async def main():
-    clear_cache()
+class CrawlScheduler:
+    # Fixed pool of workers pulling search, detail and gallery pages from one
+    # priority queue, so N requests stay in flight regardless of slow pages.
+    # A record is handed to the writer once its last detail/gallery follow-up ends.
+    # Search pages come from the frontier, SEARCH_WINDOW city/query chains at a time.
+    def __init__(self, session, business_data, writer=None, journal=None, search_frontier=None,
+                 business_store=None, workers=None):
+        self.session = session
+        self.business_data = business_data
+        self.writer = writer
+        self.journal = journal
+        self.frontier = search_frontier
+        self.business_store = business_store
+        self.workers = config.CONCURRENT_REQUESTS if workers is None else workers
+        self.queue = asyncio.PriorityQueue()
+        self.pending = {}
+        # Hashes of the (name, address) keys, like StreamingWriter._keys: these
+        # last the whole run, so they hold an int per business, not the strings.
+        self.detailed = set()
+        self.reused = set()
+        self.stopping = False
+        self.pbar = None
+        self._sequence = itertools.count()
+
+    def submit(self, priority, handler, *args):
+        self.queue.put_nowait((priority, next(self._sequence), handler, args))
+
+    def follow(self, kind, link, unique_id):
+        priority, handler = TASK_KINDS[kind]
+        self.hold(unique_id)
+        if self.journal is not None:
+            self.journal.add_task(link, kind, unique_id)
+        self.submit(priority, handler, link, unique_id)
+
+    def search(self, url):
+        if self.journal is not None:
+            self.journal.add_task(url, 'search')
+            self.journal.set_meta('frontier_position', self.frontier.issued)
+        self.submit(config.SEARCH_PRIORITY, process_url, url)
+
+    def start_chains(self, count):
+        for _ in range(count):
+            url = self.frontier.next_seed()
+            if url is None:
+                return
+            self.search(url)
+
+    def advance(self, url, listings):
+        # Called once per finished search page: continue its chain while pages
+        # come back full, otherwise give the slot to the next city/query.
+        next_url, reason = self.frontier.next_page(url, listings)
+        if next_url is not None:
+            self.search(next_url)
+        else:
+            stats.inc('search_chains_total', stop=reason)
+            self.start_chains(1)
+
+    def hold(self, unique_id):
+        self.pending[unique_id] = self.pending.get(unique_id, 0) + 1
+
+    def release(self, unique_id):
+        if self.stopping:
+            # Interrupted follow-ups stay pending in the journal for --resume.
+            return
+        remaining = self.pending[unique_id] - 1
+        if remaining:
+            self.pending[unique_id] = remaining
+            return
+        del self.pending[unique_id]
+        if self.writer is not None:
+            record = self.business_data.pop(unique_id)
+            if self.business_store is not None:
+                change = self.business_store.record(unique_id, record, detailed=hash(unique_id) not in self.reused)
+                stats.inc('business_changes_total', change=change)
+            with stats.timer('export_seconds', op='write'):
+                self.writer.write(record)
+            stats.inc('records_exported_total')
+            if self.journal is not None:
+                self.journal.drop_record(unique_id)
+
+    def save(self, unique_id):
+        if self.journal is not None:
+            self.journal.save_record(unique_id, self.business_data[unique_id])
+
+    def task_done(self, url, unique_id=None):
+        stats.inc('tasks_total', kind=http_cache.url_class(url), result='done')
+        if self.journal is not None:
+            self.journal.finish_task(url, unique_id)
+
+    def task_failed(self, url, unique_id=None):
+        stats.inc('tasks_total', kind=http_cache.url_class(url), result='failed')
+        if self.journal is not None:
+            self.journal.fail_task(url, unique_id)
+
+    def checkpoint(self):
+        # Rows reach the export file before the journal forgets their records.
+        if self.writer is not None:
+            with stats.timer('export_seconds', op='flush'):
+                self.writer.flush()
+        if self.business_store is not None:
+            self.business_store.delta.flush()
+            self.business_store.commit()
+        if self.journal is not None:
+            with stats.timer('export_seconds', op='checkpoint'):
+                self.journal.commit()
+
+    async def _worker(self):
+        while True:
+            _, _, handler, args = await self.queue.get()
+            stage = TASK_STAGES.get(handler, handler.__name__)
+            try:
+                with stats.timer('stage_seconds', stage=stage):
+                    await handler(*args, self)
+            except Exception as e:
+                stats.inc('stage_errors_total', stage=stage)
+                logging.error(f"Error in {handler.__name__} for {args[0]}: {e}")
+            finally:
+                self.queue.task_done()
+            if self.journal is not None and self.journal.commit_due():
+                self.checkpoint()
+
+    async def run(self):
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        try:
+            await self.queue.join()
+        finally:
+            self.stopping = True
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self.checkpoint()
+
+async def main(resume=False):
+    open_cache()
+    open_parse_pool()
+    open_tier_memory()
     start_time = time.time()
-    cities = read_lines_from_file(config.CITIES_FILE_PATH)
-    queries = read_lines_from_file(config.QUERIES_FILE_PATH)
-    
+    journal = crawl_state.CrawlJournal()
     business_data = {}
-    
-    async with aiohttp.ClientSession() as session:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
-        }
-        session.headers.update(headers)
-
-        urls = generate_urls(cities, queries, config.PAGE_LIMIT, config.DOMAIN)
-        chunks = [urls[i:i + config.CONCURRENT_REQUESTS] for i in range(0, len(urls), config.CONCURRENT_REQUESTS)]
-
-        with tqdm(total=len(urls), desc="Scraping Progress", unit="pages") as pbar:
-            for chunk in chunks:
-                tasks = [asyncio.create_task(process_url(url, session, business_data)) for url in chunk]
-                await asyncio.gather(*tasks)
-                pbar.update(len(chunk))
 
-    end_time = time.time()
-    end_time_str = time.strftime('%m_%d_%Y_%H-%M-%S', time.localtime(end_time))
-    save_to_csv(business_data, f'ypscrape_{end_time_str}.csv')
+    resuming = resume and journal.get_meta('export_base') and not journal.get_meta('finished')
+    if resuming:
+        export_base = journal.get_meta('export_base')
+        columns = journal.get_meta('columns')
+        writer = exporters.open_writer(export_base, columns, journal.get_meta('export_format'), append=True)
+        business_data.update(journal.open_records())
+        tasks = journal.pending_tasks()
+        logging.info(f"Resuming {export_base}: {len(tasks)} pending tasks, {len(business_data)} open records")
+    else:
+        if resume:
+            logging.warning("No interrupted crawl to resume; starting a new one")
+        start_time_str = time.strftime('%m_%d_%Y_%H-%M-%S', time.localtime(start_time))
+        export_base = f'ypscrape_{start_time_str}'
+        columns = exporters.export_columns(frontier.iter_lines(config.QUERIES_FILE_PATH), config.DOWNLOAD_IMAGES)
+        writer = exporters.open_writer(export_base, columns)
+
+        journal.reset()
+        journal.set_meta('export_base', export_base)
+        journal.set_meta('export_format', config.EXPORT_FORMAT)
+        journal.set_meta('columns', columns)
+        journal.set_meta('cities_path', config.CITIES_FILE_PATH)
+        journal.set_meta('queries_path', config.QUERIES_FILE_PATH)
+        journal.set_meta('page_limit', config.PAGE_LIMIT)
+        journal.set_meta('incremental', config.INCREMENTAL)
+        journal.set_meta('download_images', config.DOWNLOAD_IMAGES)
+        tasks = []
+    journal.commit()
+    # A Parquet writer moves on to part files, so writer.path is not always the export's path.
+    export_path = exporters.export_path(export_base, journal.get_meta('export_format'))
+    if journal.get_meta('download_images'):
+        open_image_pipeline()
+    store = None
+    if journal.get_meta('incremental'):
+        store = business_store.BusinessStore()
+        store.begin_run(resume=resuming)
+        store.delta = exporters.open_writer(f"{export_base}_delta", ['change'] + columns,
+                                            journal.get_meta('export_format'), append=resuming)
+    # On --resume the seeds already handed out are skipped; their unfinished
+    # pages are among the pending tasks.
+    queries_path = journal.get_meta('queries_path')
+    seeds = frontier.iter_seeds(frontier.iter_lines(journal.get_meta('cities_path')), queries_path)
+    search_frontier = frontier.SearchFrontier(seeds, journal.get_meta('page_limit'),
+                                              skip=journal.get_meta('frontier_position', 0))
+    metrics_server = None
 
+    try:
+        async with transport.open_client(config.HTTP_CLIENT) as session:
+
+            scheduler = CrawlScheduler(session, business_data, writer, journal, search_frontier, store)
+            stats.gauge_function('queue_depth', scheduler.queue.qsize)
+            stats.gauge_function('open_records', lambda: len(scheduler.pending))
+            stats.gauge_function('rate_limit_per_second', rate_limiter.rates, label='host')
+            if config.METRICS_PORT:
+                metrics_server = await stats.serve(config.METRICS_HOST, config.METRICS_PORT)
+            chains = 0
+            for url, kind, unique_id in tasks:
+                if kind == 'search':
+                    scheduler.submit(config.SEARCH_PRIORITY, process_url, url)
+                    chains += 1
+                elif unique_id in business_data:
+                    scheduler.follow(kind, url, unique_id)
+            scheduler.start_chains(max(0, config.SEARCH_WINDOW - chains))
+            # Records whose follow-ups all finished before the interruption.
+            for unique_id in [uid for uid in business_data if uid not in scheduler.pending]:
+                scheduler.hold(unique_id)
+                scheduler.release(unique_id)
+
+            # The number of search pages is only known once every chain has ended.
+            from tqdm import tqdm
+            with tqdm(initial=journal.task_counts('search').get(crawl_state.DONE, 0),
+                      desc="Scraping Progress", unit="pages") as pbar:
+                scheduler.pbar = pbar
+                await scheduler.run()
+        if store is not None:
+            logging.info(f"{store.finish_run()} businesses vanished since the last run")
+        journal.set_meta('finished', True)
+    finally:
+        if metrics_server is not None:
+            await metrics_server.cleanup()
+        await close_driver_pool()
+        close_image_pipeline()
+        tier_memory.save()
+        with stats.timer('export_seconds', op='close'):
+            writer.close()
+        if store is not None:
+            store.delta.close()
+            store.close()
+        journal.close()
+        cache.close()
+        close_parse_pool()
+        write_metrics_summary(writer.path)
+
+    end_time = time.time()
     elapsed_time = end_time - start_time
     hours, rem = divmod(elapsed_time, 3600)
     minutes, seconds = divmod(rem, 60)
-    logging.info(f"Saved results to {config.EXPORTS_PATH}/ypscrape_{end_time_str}.csv")
+    if resuming:
+        # rows_written only counts this session's rows, not those written before the resume.
+        logging.info(f"Saved {writer.rows_written} more results this session to {export_path}")
+    else:
+        logging.info(f"Saved {writer.rows_written} results to {export_path}")
+    if config.NORMALIZE_EXPORT:
+        normalize.normalize_export(export_path)
+    if store is not None:
+        logging.info(f"Saved {store.delta.rows_written} new/changed/vanished businesses to {store.delta.path}")
     logging.info(f"Total time taken: {int(hours)} hours, {int(minutes)} minutes, {int(seconds)} seconds")
 
-async def process_url(url, session, business_data):
-    article_data = await extract(url, session)
-    parsed_url = urlparse(url)
-    query_dict = dict(parse_qsl(parsed_url.query))
-    city = query_dict.get('geo_location_terms', '')
-    query = query_dict.get('search_terms', '')
-
-    await transform(article_data, city, query, business_data, session)
-
-if __name__ == "__main__":
-    asyncio.run(main())
+async def process_url(url, scheduler):
+    listings = None
+    try:
+        parsed_url = urlparse(url)
+        query_dict = dict(parse_qsl(parsed_url.query))
+        city = query_dict.get('geo_location_terms', '')
+        query = query_dict.get('search_terms', '')
+
+        listings = await extract(url, scheduler.session, query)
+        if listings is None:
+            scheduler.task_failed(url)
+            return
+        await transform(listings, city, query, scheduler.business_data, scheduler)
+        scheduler.task_done(url)
+    finally:
+        if scheduler.frontier is not None and not scheduler.stopping:
+            scheduler.advance(url, listings)
+        if scheduler.pbar is not None:
+            scheduler.pbar.update(1)
+
+TASK_KINDS = {
+    'search': (config.SEARCH_PRIORITY, process_url),
+    'detail': (config.DETAIL_PRIORITY, process_follow_link),
+    'gallery': (config.GALLERY_PRIORITY, process_gallery),
+    'images': (config.IMAGE_PRIORITY, process_images),
+}
+TASK_STAGES = {handler: kind for kind, (_, handler) in TASK_KINDS.items()}
+
+def city_batches(cities, size):
+    while True:
+        batch = list(itertools.islice(cities, size))
+        if not batch:
+            return
+        yield batch
+
+def run_coordinator(resume=False, local_workers=0, worker_args=()):
+    # Splits the cities into batches in the shared work store, waits for the
+    # workers to drain it and merges their records into one export.
+    store = work_store.WorkStore()
+    start_time = time.time()
+    if resume and store.get_meta('export_base') and not store.get_meta('finished'):
+        logging.info(f"Resuming {store.get_meta('export_base')}: {store.unfinished()} batches left")
+    else:
+        cities = frontier.iter_lines(config.CITIES_FILE_PATH)
+        queries = list(frontier.iter_lines(config.QUERIES_FILE_PATH))
+        start_time_str = time.strftime('%m_%d_%Y_%H-%M-%S', time.localtime(start_time))
+        store.seed({
+            'export_base': f'ypscrape_{start_time_str}',
+            'export_format': config.EXPORT_FORMAT,
+            'columns': exporters.export_columns(queries, config.DOWNLOAD_IMAGES),
+            'queries': queries,
+            'page_limit': config.PAGE_LIMIT,
+            'download_images': config.DOWNLOAD_IMAGES,
+        }, city_batches(cities, config.WORK_BATCH_CITIES))
+
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cli.py'), '--worker',
+               *worker_args]
+    workers = [subprocess.Popen(command) for _ in range(local_workers)]
+    try:
+        from tqdm import tqdm
+        counts = store.batch_counts()
+        with tqdm(total=sum(counts.values()), desc="Batches", unit="batches") as pbar:
+            while True:
+                counts = store.batch_counts()
+                pbar.n = counts.get(work_store.DONE, 0) + counts.get(work_store.FAILED, 0)
+                pbar.set_postfix(workers=store.live_workers(), leased=counts.get(work_store.LEASED, 0))
+                if not store.unfinished():
+                    break
+                if workers and all(worker.poll() is not None for worker in workers) and not store.live_workers():
+                    logging.error("All local workers exited before the crawl finished; rerun with --resume")
+                    return
+                time.sleep(config.WORK_POLL_INTERVAL)
+
+        if counts.get(work_store.FAILED):
+            logging.warning(f"{counts[work_store.FAILED]} batches failed after {config.WORK_MAX_ATTEMPTS} attempts")
+        writer = exporters.open_writer(store.get_meta('export_base'), store.get_meta('columns'),
+                                       store.get_meta('export_format'))
+        try:
+            for record in store.merged_records():
+                writer.write(record)
+        finally:
+            writer.close()
+        store.set_meta('finished', True)
+        logging.info(f"Saved {writer.rows_written} results to {writer.path}")
+        if config.NORMALIZE_EXPORT:
+            normalize.normalize_export(writer.path)
+        logging.info(f"Total time taken: {time.time() - start_time:.0f} seconds")
+    finally:
+        # Workers exit on their own once the store is drained; otherwise
+        # interrupt them so they shut their parse pools down cleanly.
+        for worker in workers:
+            try:
+                worker.wait(timeout=config.WORK_POLL_INTERVAL + 10)
+            except subprocess.TimeoutExpired:
+                worker.send_signal(signal.SIGINT)
+                worker.wait()
+        store.close()
+
+async def keep_lease(store, worker, batch_id):
+    while True:
+        await asyncio.sleep(config.WORK_HEARTBEAT_INTERVAL)
+        if not store.heartbeat(worker, batch_id):
+            logging.warning(f"Lost the lease on batch {batch_id}")
+            return
+
+async def crawl_batch(session, store, worker, batch_id, cities):
+    queries = store.get_meta('queries')
+    seeds = ((city, query) for city in cities for query in queries)
+    collector = work_store.BatchCollector()
+    scheduler = CrawlScheduler(session, {}, collector, search_frontier=frontier.SearchFrontier(
+        seeds, store.get_meta('page_limit')))
+    scheduler.start_chains(config.SEARCH_WINDOW)
+    heartbeat = asyncio.create_task(keep_lease(store, worker, batch_id))
+    try:
+        await scheduler.run()
+    except BaseException:
+        store.abandon(worker, batch_id)
+        raise
+    finally:
+        heartbeat.cancel()
+    return collector.records
+
+async def run_worker():
+    # Leases city batches until the store has nothing left, crawling each with
+    # the same scheduler as a single-process run.
+    store = work_store.WorkStore()
+    worker = work_store.worker_name()
+    open_cache()
+    open_parse_pool()
+    open_tier_memory()
+    batches = 0
+    try:
+        async with transport.open_client(config.HTTP_CLIENT) as session:
+            while True:
+                lease = store.lease(worker)
+                if lease is None:
+                    if store.get_meta('export_base') and not store.unfinished():
+                        break
+                    await asyncio.sleep(config.WORK_POLL_INTERVAL)
+                    continue
+                batch_id, cities = lease
+                if store.get_meta('download_images'):
+                    open_image_pipeline()
+                records = await crawl_batch(session, store, worker, batch_id, cities)
+                if store.complete(worker, batch_id, records):
+                    batches += 1
+                    logging.info(f"Batch {batch_id} ({', '.join(cities)}): {len(records)} records")
+                else:
+                    logging.warning(f"Discarding batch {batch_id}: its lease moved to another worker")
+    finally:
+        await close_driver_pool()
+        close_image_pipeline()
+        tier_memory.save()
+        cache.close()
+        close_parse_pool()
+        if store.get_meta('export_base'):
+            # One summary per worker next to the coordinator's export.
+            write_metrics_summary(os.path.join(config.EXPORTS_PATH, store.get_meta('export_base')),
+                                  suffix='.' + ''.join(c if c.isalnum() else '-' for c in worker))
+        store.close()
+    logging.info(f"Worker {worker} finished {batches} batches")
+
+def write_metrics_summary(export_path, suffix=''):
+    lookups = stats.counter('cache_lookups_total')
+    path = f"{os.path.splitext(export_path)[0]}{suffix}.metrics.json"
+    stats.write_summary(path, cache_hit_rate=round(stats.counter('cache_lookups_total', result='hit') / lookups, 4)
+                        if lookups else None)
+    logging.info(f"Metrics summary written to {path}")
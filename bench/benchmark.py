@@ -0,0 +1,436 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import socket
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import defaultdict
+import config
+from bench import fixture_server
+
+# Offline end-to-end benchmark. Starts the fixture server in a child process,
+# points config.DOMAIN at it and runs the real crawl (YPScraper.main) with the
+# pipeline stages wrapped in timers, then micro-benchmarks the parsers and the
+# CSV export on the same pages/records. Run from the repository root:
+#
+#   python -m bench.benchmark --save-baseline
+#   python -m bench.benchmark --compare          # after a change
+#
+# config is patched before YPScraper is imported so that module-level defaults
+# (journal path, cache backend, ...) pick up the benchmark's values.
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+BASELINE_PATH = os.path.join(RESULTS_DIR, 'baseline.json')
+# Metric path -> True if higher is better.
+TRACKED_METRICS = {
+    'crawl.pages_per_sec': True,
+    'crawl.latency_ms.p50': False,
+    'crawl.latency_ms.p99': False,
+    'crawl.peak_rss_mb': False,
+    'crawl.cpu_s.total': False,
+    'parse_ms_per_page.lxml.search': False,
+    'parse_ms_per_page.lxml.detail': False,
+    'parse_ms_per_page.lxml.gallery': False,
+    'export_ms_per_1k_rows.save_to_csv': False,
+    'export_ms_per_1k_rows.streaming_csv': False,
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, recordings, site_options, fault_options):
+    process = multiprocessing.Process(target=fixture_server.serve, daemon=True,
+                                      args=(port, recordings, site_options, fault_options))
+    process.start()
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return process
+        except OSError:
+            time.sleep(0.05)
+    process.terminate()
+    raise RuntimeError(f"Fixture server did not start on port {port}")
+
+
+def server_stats(domain):
+    with urllib.request.urlopen(f"{domain}/_stats") as response:
+        return json.load(response)
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class StageTimer:
+    # Wall time for every stage; CPU time only for synchronous stages, since an
+    # awaiting coroutine's process_time would include whatever else ran meanwhile.
+    def __init__(self):
+        self.calls = defaultdict(int)
+        self.wall = defaultdict(float)
+        self.cpu = defaultdict(float)
+        self.samples = defaultdict(list)
+
+    def wrap_async(self, stage, func, stage_of=None):
+        async def timed(*args, **kwargs):
+            name = stage_of(*args) if stage_of else stage
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.calls[name] += 1
+                self.wall[name] += elapsed
+                self.samples[name].append(elapsed)
+        return timed
+
+    def wrap_sync(self, stage, func):
+        def timed(*args, **kwargs):
+            start, start_cpu = time.perf_counter(), time.process_time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.calls[stage] += 1
+                self.wall[stage] += time.perf_counter() - start
+                self.cpu[stage] += time.process_time() - start_cpu
+        return timed
+
+    def summary(self):
+        return {
+            stage: {
+                'calls': self.calls[stage],
+                'wall_s': round(self.wall[stage], 4),
+                'cpu_s': round(self.cpu[stage], 4) if stage in self.cpu else None,
+            }
+            for stage in sorted(self.calls)
+        }
+
+
+def configure(workdir, domain, args):
+    cities_path = os.path.join(workdir, 'cities.txt')
+    queries_path = os.path.join(workdir, 'queries.txt')
+    with open(cities_path, 'w') as file:
+        file.write('\n'.join(f"City{i}, TX" for i in range(args.cities)))
+    with open(queries_path, 'w') as file:
+        file.write('\n'.join(['plumber', 'dentist', 'electrician', 'roofing', 'auto repair'][:args.queries]))
+    config.DOMAIN = domain
+    config.CITIES_FILE_PATH = cities_path
+    config.QUERIES_FILE_PATH = queries_path
+    config.EXPORTS_PATH = workdir
+    config.JOURNAL_PATH = os.path.join(workdir, 'crawl_state.sqlite3')
+    config.CACHE_BACKEND = 'memory'
+    config.GALLERY_TIER_PATH = None
+    config.GALLERY_BROWSER = 'never'
+    config.METRICS_PORT = None
+    config.PAGE_LIMIT = args.pages
+    config.CONCURRENT_REQUESTS = args.concurrency
+    config.PARSER_BACKEND = args.parser
+    config.HTTP_CLIENT = args.http_client
+    if args.parse_workers is not None:
+        config.PARSE_WORKERS = args.parse_workers
+    if not args.rate_limit:
+        # Measure the pipeline, not the politeness delay towards the real site.
+        config.RATE_LIMIT_INITIAL = config.RATE_LIMIT_MAX = config.RATE_LIMIT_BURST = 1e6
+
+
+def run_crawl(domain):
+    import exporters
+    import YPScraper
+
+    timer = StageTimer()
+    rows = []
+    fetch_url = YPScraper.fetch_url
+
+    async def fetch(url, session):
+        # Pages fetched successfully, counted by the page kind.
+        body = await fetch_url(url, session)
+        if body is not None:
+            timer.calls['pages'] += 1
+        return body
+
+    def kind_of(url, session):
+        return f"fetch.{fixture_server.http_cache.url_class(url)}"
+
+    def parse_stage(func, *args):
+        return f"parse.{func.__name__}"
+
+    YPScraper.fetch_url = timer.wrap_async('fetch', fetch, kind_of)
+    YPScraper.parse = timer.wrap_async('parse', YPScraper.parse, parse_stage)
+    YPScraper.transform = timer.wrap_async('transform', YPScraper.transform)
+    YPScraper.process_follow_links = timer.wrap_sync('process_follow_links', YPScraper.process_follow_links)
+    YPScraper.CrawlScheduler.checkpoint = timer.wrap_sync('checkpoint', YPScraper.CrawlScheduler.checkpoint)
+
+    open_writer = exporters.open_writer
+
+    def timed_writer(*args, **kwargs):
+        writer = open_writer(*args, **kwargs)
+        write = writer.write
+
+        def write_and_keep(record):
+            rows.append(dict(record))
+            write(record)
+        writer.write = timer.wrap_sync('export.write', write_and_keep)
+        writer.flush = timer.wrap_sync('export.flush', writer.flush)
+        writer.close = timer.wrap_sync('export.close', writer.close)
+        return writer
+    exporters.open_writer = timed_writer
+
+    start, start_cpu = time.perf_counter(), time.process_time()
+    asyncio.run(YPScraper.main())
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - start_cpu
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+
+    latencies = [s for stage, samples in timer.samples.items() if stage.startswith('fetch.') for s in samples]
+    pages = timer.calls.pop('pages', 0)
+    stages = timer.summary()
+    parse_calls = sum(v['calls'] for k, v in stages.items() if k.startswith('parse.'))
+    parse_wall = sum(v['wall_s'] for k, v in stages.items() if k.startswith('parse.'))
+    return {
+        'pages': pages,
+        'records': len(rows),
+        'elapsed_s': round(elapsed, 3),
+        'pages_per_sec': round(pages / elapsed, 2) if elapsed else None,
+        'parse_wall_ms_per_page': round(parse_wall / parse_calls * 1000, 3) if parse_calls else None,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+            'p99': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        },
+        # ru_maxrss is in KiB on Linux; children covers the parse pool (the
+        # fixture server is still running and not yet reaped).
+        'peak_rss_mb': round(self_usage.ru_maxrss / 1024, 1),
+        'peak_rss_children_mb': round(children.ru_maxrss / 1024, 1),
+        'downloaded_mb': round(YPScraper.stats.counter('downloaded_bytes_total') / 1024 ** 2, 2),
+        'cpu_s': {
+            'total': round(cpu + children.ru_utime + children.ru_stime, 3),
+            'main': round(cpu, 3),
+            'parse_workers': round(children.ru_utime + children.ru_stime, 3),
+        },
+        'stages': stages,
+    }, rows
+
+
+def sample_pages(site, cities, queries, count):
+    import parsers
+    pages = {'search': [], 'detail': [], 'gallery': []}
+    for i in range(count):
+        search = site.search(queries[i % len(queries)], cities[i % len(cities)], 1)
+        pages['search'].append(search)
+        for link in parsers.parse_search_page_lxml(search, '')[:1]:
+            path = link['follow_links'][0]
+            pages['detail'].append(site.detail(path))
+            pages['gallery'].append(site.gallery(f"{path}/photos"))
+    return pages
+
+
+def bench_parsers(pages, repeat):
+    import parsers
+    backends = {
+        'lxml': {'search': parsers.parse_search_page_lxml, 'detail': parsers.parse_detail_page_lxml,
+                 'gallery': parsers.parse_gallery_page_lxml},
+        'bs4': {'search': parsers.parse_search_page_bs, 'detail': parsers.parse_detail_page_bs,
+                'gallery': parsers.parse_gallery_page_bs},
+    }
+    results = {}
+    for backend, funcs in backends.items():
+        results[backend] = {}
+        for kind, func in funcs.items():
+            args = [(page, 'plumber') if kind == 'search' else (page,) for page in pages[kind]]
+            start = time.process_time()
+            for _ in range(repeat):
+                for call_args in args:
+                    func(*call_args)
+            results[backend][kind] = round((time.process_time() - start) / (repeat * len(args)) * 1000, 3)
+    return results
+
+
+def bench_export(rows, workdir, repeat):
+    import exporters
+    import YPScraper
+    if not rows:
+        return {}
+    business_data = {(row.get('name'), row.get('address'), i): row for i, row in enumerate(rows)}
+    columns = sorted({key for row in rows for key in row if key.endswith('_rank')}) + config.DFCOL_ORDER
+    results = {}
+
+    start = time.process_time()
+    for i in range(repeat):
+        YPScraper.save_to_csv(business_data, f'bench_save_to_csv_{i}.csv')
+    results['save_to_csv'] = (time.process_time() - start) / repeat
+
+    start = time.process_time()
+    for i in range(repeat):
+        writer = exporters.CSVWriter(os.path.join(workdir, f'bench_stream_{i}.csv'), columns)
+        for row in rows:
+            writer.write(dict(row))
+        writer.close()
+    results['streaming_csv'] = (time.process_time() - start) / repeat
+
+    try:
+        import pandas
+    except ImportError:
+        pandas = None
+    if pandas is not None:
+        import normalize
+        source = os.path.join(workdir, 'bench_stream_0.csv')
+        start = time.process_time()
+        target = normalize.normalize_export(source, dedup=False)
+        results['normalize_csv'] = time.process_time() - start
+        check_blank_columns(source, target)
+    return {name: round(seconds / len(rows) * 1e6, 3) for name, seconds in results.items()}
+
+
+def check_blank_columns(source, target):
+    # Columns the export left blank must stay blank in the normalized copy
+    # (not 'None', 'nan' or an empty list written as text).
+    import csv
+    with open(source, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    blank = {column for column in rows[0] if not any(row[column] for row in rows)} if rows else set()
+    with open(target, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            filled = sorted(column for column in blank if row[column])
+            if filled:
+                raise RuntimeError(f"Normalized export filled blank columns {filled} in {target}")
+
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{path}."))
+        else:
+            flat[path] = value
+    return flat
+
+
+def compare(results, baseline, tolerance):
+    if baseline.get('settings') != results['settings']:
+        print(f"\nWarning: baseline was recorded with different settings: {baseline.get('settings')}")
+    current, previous = flatten(results), flatten(baseline)
+    regressions = []
+    print(f"\n{'metric':<42}{'baseline':>12}{'current':>12}{'change':>10}")
+    for metric, higher_is_better in TRACKED_METRICS.items():
+        old, new = previous.get(metric), current.get(metric)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        flag = '  REGRESSION' if worse > tolerance else ''
+        if flag:
+            regressions.append(metric)
+        print(f"{metric:<42}{old:>12}{new:>12}{change:>+10.1%}{flag}")
+    return regressions
+
+
+def report(results):
+    crawl = results['crawl']
+    print(f"\nCrawled {crawl['pages']} pages ({crawl['records']} records) in {crawl['elapsed_s']}s: "
+          f"{crawl['pages_per_sec']} pages/s")
+    print(f"Fetch latency p50 {crawl['latency_ms']['p50']} ms, p99 {crawl['latency_ms']['p99']} ms, "
+          f"{crawl['downloaded_mb']} MB downloaded")
+    print(f"Peak RSS {crawl['peak_rss_mb']} MB (parse workers {crawl['peak_rss_children_mb']} MB), "
+          f"CPU {crawl['cpu_s']['total']}s")
+    print(f"\n{'stage':<32}{'calls':>8}{'wall s':>10}{'cpu s':>10}")
+    for stage, values in crawl['stages'].items():
+        cpu = values['cpu_s'] if values['cpu_s'] is not None else '-'
+        print(f"{stage:<32}{values['calls']:>8}{values['wall_s']:>10}{cpu:>10}")
+    print(f"\n{'parse ms/page':<16}" + ''.join(f"{kind:>10}" for kind in ('search', 'detail', 'gallery')))
+    for backend, kinds in results['parse_ms_per_page'].items():
+        print(f"{backend:<16}" + ''.join(f"{kinds[kind]:>10}" for kind in ('search', 'detail', 'gallery')))
+    for name, ms in results['export_ms_per_1k_rows'].items():
+        print(f"export {name}: {ms} ms per 1k rows")
+    print(f"Server: {results['server']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Offline crawl benchmark against the local fixture server')
+    parser.add_argument('--cities', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=2, choices=range(1, 6))
+    parser.add_argument('--pages', type=int, default=config.PAGE_LIMIT, help='search pages per city/query')
+    parser.add_argument('--concurrency', type=int, default=config.CONCURRENT_REQUESTS)
+    parser.add_argument('--parser', choices=('lxml', 'bs4'), default=config.PARSER_BACKEND)
+    parser.add_argument('--http-client', choices=('aiohttp', 'httpx'), default=config.HTTP_CLIENT)
+    parser.add_argument('--parse-workers', type=int, help='override config.PARSE_WORKERS (0 parses inline)')
+    parser.add_argument('--rate-limit', action='store_true', help='keep the configured rate limits')
+    parser.add_argument('--recordings', help='replay recorded pages instead of synthetic ones')
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--jitter', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=0)
+    parser.add_argument('--compress', action='store_true', help='serve gzip/deflate encoded pages')
+    parser.add_argument('--repeat', type=int, default=20, help='iterations for the parse/export micro-benchmarks')
+    parser.add_argument('--output', help='write the results as JSON to this path')
+    parser.add_argument('--save-baseline', action='store_true', help=f'store the results as {BASELINE_PATH}')
+    parser.add_argument('--compare', nargs='?', const=BASELINE_PATH, metavar='BASELINE',
+                        help='compare against a baseline; exits 1 on regressions beyond --tolerance')
+    parser.add_argument('--tolerance', type=float, default=0.10)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    port = free_port()
+    domain = f"http://127.0.0.1:{port}"
+    site_options = {}
+    fault_options = dict(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                         throttle_rate=args.throttle_rate, retry_after=args.retry_after, compress=args.compress)
+    server = start_server(port, args.recordings, site_options, fault_options)
+    try:
+        with tempfile.TemporaryDirectory(prefix='ypbench-') as workdir:
+            configure(workdir, domain, args)
+            crawl, rows = run_crawl(domain)
+            stats = server_stats(domain)
+            logging.getLogger().setLevel(logging.WARNING)
+            site = fixture_server.make_site(args.recordings, **site_options)
+            pages = sample_pages(site, ['Austin, TX', 'Miami, FL'], ['plumber', 'dentist'], 5)
+            results = {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'settings': {key: value for key, value in vars(args).items()
+                             if key not in ('output', 'save_baseline', 'compare', 'tolerance')},
+                'crawl': crawl,
+                'parse_ms_per_page': bench_parsers(pages, args.repeat),
+                'export_ms_per_1k_rows': bench_export(rows, workdir, max(1, args.repeat // 10)),
+                'server': stats,
+            }
+    finally:
+        server.terminate()
+        server.join()
+
+    report(results)
+    paths = [args.output] if args.output else []
+    if args.save_baseline:
+        paths.append(BASELINE_PATH)
+    for path in paths:
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(path, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"Wrote {path}")
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,272 @@
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import string
+import struct
+import zlib
+from collections import Counter
+from aiohttp import web
+import http_cache
+
+# Local stand-in for yellowpages.com. By default it renders synthetic, YP-shaped
+# search/detail/gallery pages from bench/templates (deterministic per URL, with
+# a configurable share of businesses that show up under several queries). With
+# --recordings it replays real pages exported from the HTTP cache instead.
+# Latency, 500s and 429s can be injected to exercise retries and rate limiting.
+# Gallery images are served from /blob/ as small PNGs (a few distinct images
+# shared by every gallery, so content dedup has work to do), with Range support.
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), 'templates')
+CATEGORIES = ['Plumbers', 'Dentists', 'Electricians', 'Roofing Contractors', 'Auto Repair', 'Restaurants']
+WORDS = ['Ace', 'Allied', 'Best', 'Blue', 'City', 'Elite', 'First', 'Golden', 'Metro', 'Prime', 'Pro', 'Royal']
+STREETS = ['Main St', 'Oak Ave', 'Congress Ave', 'Lamar Blvd', 'Elm St', 'Park Rd']
+
+
+def _load_template(name):
+    with open(os.path.join(TEMPLATES_DIR, name), 'r', encoding='utf-8') as file:
+        return string.Template(file.read())
+
+
+def _slug(value):
+    return re.sub(r'[^a-z0-9]+', '-', value.lower()).strip('-')
+
+
+def _seeded(*parts):
+    return random.Random(hashlib.sha1('|'.join(map(str, parts)).encode('utf-8')).hexdigest())
+
+
+def _png_chunk(tag, data):
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+
+def synthetic_image(name, variants=4, width=160, height=120):
+    # Noisy RGB PNG (about 60 KB) chosen by the trailing image number in name.
+    number = re.findall(r'\d+', name)
+    rng = _seeded('image', int(number[-1]) % variants if number else 0)
+    rows = b''.join(b'\x00' + bytes(rng.getrandbits(8) for _ in range(width * 3)) for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n'
+            + _png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + _png_chunk(b'IDAT', zlib.compress(rows))
+            + _png_chunk(b'IEND', b''))
+
+
+class SyntheticSite:
+    def __init__(self, listings_per_page=30, full_pages=2, overlap=0.3, images_per_gallery=12, filler_kb=40):
+        self.listings_per_page = listings_per_page
+        self.full_pages = full_pages
+        self.overlap = overlap
+        self.images_per_gallery = images_per_gallery
+        self.filler = ('<div class="footer-links">' + '<a href="/x">Popular searches near you</a>' * 16 + '</div>') \
+            * max(1, filler_kb * 1024 // 800)
+        self.templates = {name: _load_template(f'{name}.html') for name in ('search', 'listing', 'detail', 'gallery')}
+
+    def _business(self, lid, city_slug):
+        rng = _seeded('business', lid)
+        category = rng.choice(CATEGORIES)
+        name = f"{rng.choice(WORDS)} {rng.choice(WORDS)} {category[:-1] if category.endswith('s') else category}"
+        city, _, state = city_slug.rpartition('-')
+        return {
+            'lid': lid,
+            'name': name,
+            'category': category,
+            'path': f"/{city_slug}/mip/{_slug(name)}-{lid}",
+            'phone': f"({rng.randint(200, 999)}) 555-{rng.randint(0, 9999):04d}",
+            'fax': f"({rng.randint(200, 999)}) 555-{rng.randint(0, 9999):04d}",
+            'street': f"{rng.randint(1, 9999)} {rng.choice(STREETS)}",
+            'locality': f"{city.replace('-', ' ').title()}, {state.upper()} {rng.randint(10000, 99999)}",
+            'website': f"https://www.{_slug(name)}.example.com",
+            'domain': f"{_slug(name)}.example.com",
+            'reviews': rng.randint(0, 400),
+            'slogan': f"Serving {city.replace('-', ' ').title()} since {rng.randint(1950, 2020)}",
+            'general_info': ' '.join(rng.choice(WORDS) for _ in range(60)),
+            'snippet': ' '.join(rng.choice(WORDS).lower() for _ in range(30)),
+        }
+
+    def page_size(self, page):
+        if page <= self.full_pages:
+            return self.listings_per_page
+        if page == self.full_pages + 1:
+            return self.listings_per_page // 2
+        return 0
+
+    def search(self, query, city, page):
+        city_slug = _slug(city)
+        listings = []
+        for rank in range(1, self.page_size(page) + 1):
+            position = (page - 1) * self.listings_per_page + rank
+            rng = _seeded('listing', city_slug, query, position)
+            scope = 'shared' if rng.random() < self.overlap else query
+            lid = int(hashlib.sha1(f"{city_slug}|{scope}|{position}".encode('utf-8')).hexdigest()[:9], 16)
+            business = self._business(lid, city_slug)
+            listings.append(self.templates['listing'].safe_substitute(
+                business, rank=rank, city_slug=city_slug, query_slug=_slug(query)))
+        return self.templates['search'].safe_substitute(
+            query=query, city=city, listings='\n'.join(listings), count=len(listings), filler=self.filler)
+
+    def _business_from_path(self, path):
+        match = re.match(r'/([^/]+)/mip/[^/]*-(\d+)', path)
+        if not match:
+            return None
+        return self._business(int(match.group(2)), match.group(1))
+
+    def detail(self, path):
+        business = self._business_from_path(path)
+        if business is None:
+            return None
+        return self.templates['detail'].safe_substitute(business, filler=self.filler)
+
+    def gallery(self, path):
+        business = self._business_from_path(path)
+        if business is None:
+            return None
+        images = '\n'.join(
+            f'<a class="media" data-media=\'{{"id": {i}}}\' href="#"><img src="/blob/{business["lid"]}_{i}.png"></a>'
+            for i in range(self.images_per_gallery))
+        return self.templates['gallery'].safe_substitute(business, images=images, filler=self.filler)
+
+
+class RecordedSite:
+    # Replays recorded pages by kind; a URL always maps to the same recording.
+    def __init__(self, directory):
+        self.pages = {}
+        for kind in ('search', 'detail', 'gallery'):
+            files = sorted(glob.glob(os.path.join(directory, f'{kind}*.html')))
+            if not files:
+                raise ValueError(f"No {kind}*.html recordings in {directory}")
+            self.pages[kind] = [open(path, 'r', encoding='utf-8').read() for path in files]
+
+    def _pick(self, kind, key):
+        pages = self.pages[kind]
+        return pages[int(hashlib.sha1(key.encode('utf-8')).hexdigest(), 16) % len(pages)]
+
+    def search(self, query, city, page):
+        return self._pick('search', f"{query}|{city}|{page}")
+
+    def detail(self, path):
+        return self._pick('detail', path)
+
+    def gallery(self, path):
+        return self._pick('gallery', path)
+
+
+def make_app(site, latency=0.0, jitter=0.5, error_rate=0.0, throttle_rate=0.0, retry_after=1, compress=False):
+    stats = Counter()
+
+    @web.middleware
+    async def faults(request, handler):
+        if request.path == '/_stats':
+            return await handler(request)
+        kind = http_cache.url_class(str(request.url))
+        stats[f'{kind}_requests'] += 1
+        if latency:
+            await asyncio.sleep(max(0.0, random.uniform(latency * (1 - jitter), latency * (1 + jitter))))
+        roll = random.random()
+        if roll < throttle_rate:
+            stats['throttled'] += 1
+            return web.Response(status=429, headers={'Retry-After': str(retry_after)})
+        if roll < throttle_rate + error_rate:
+            stats['errors'] += 1
+            return web.Response(status=500)
+        response = await handler(request)
+        # 'bytes' counts bodies before any Content-Encoding.
+        stats['bytes'] += response.content_length or 0
+        if compress:
+            response.enable_compression()
+        return response
+
+    def html(body):
+        if body is None:
+            raise web.HTTPNotFound()
+        return web.Response(text=body, content_type='text/html')
+
+    async def search(request):
+        page = int(request.query.get('page', 1))
+        return html(site.search(request.query.get('search_terms', ''), request.query.get('geo_location_terms', ''), page))
+
+    async def business(request):
+        path = request.path
+        if path.rstrip('/').endswith('/photos') or '/gallery' in path:
+            return html(site.gallery(path))
+        return html(site.detail(path))
+
+    async def image(request):
+        body = synthetic_image(request.match_info['name'])
+        start = request.http_range.start or 0
+        if start >= len(body):
+            raise web.HTTPRequestRangeNotSatisfiable()
+        if start:
+            return web.Response(status=206, body=body[start:], content_type='image/png',
+                                headers={'Content-Range': f'bytes {start}-{len(body) - 1}/{len(body)}'})
+        return web.Response(body=body, content_type='image/png')
+
+    async def stats_view(request):
+        return web.json_response(dict(stats))
+
+    app = web.Application(middlewares=[faults])
+    app.router.add_get('/_stats', stats_view)
+    app.router.add_get('/search', search)
+    app.router.add_get('/blob/{name}', image)
+    app.router.add_get('/{tail:.+}', business)
+    return app
+
+
+def make_site(recordings=None, **options):
+    return RecordedSite(recordings) if recordings else SyntheticSite(**options)
+
+
+def serve(port, recordings=None, site_options=None, fault_options=None):
+    app = make_app(make_site(recordings, **(site_options or {})), **(fault_options or {}))
+    web.run_app(app, host='127.0.0.1', port=port, print=None, access_log=None)
+
+
+def export_recordings(cache_path, directory, per_kind=5):
+    # Turn pages from a real crawl's SQLite HTTP cache into replayable recordings.
+    os.makedirs(directory, exist_ok=True)
+    written = Counter()
+    conn = sqlite3.connect(cache_path)
+    for url, body in conn.execute('SELECT url, body FROM responses ORDER BY fetched_at'):
+        kind = http_cache.url_class(url.split('#', 1)[0])
+        if written[kind] >= per_kind:
+            continue
+        with open(os.path.join(directory, f'{kind}{written[kind]:03d}.html'), 'w', encoding='utf-8') as file:
+            file.write(zlib.decompress(body).decode('utf-8'))
+        written[kind] += 1
+    conn.close()
+    return dict(written)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Local YellowPages fixture server')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--recordings', help='directory of search*/detail*/gallery*.html pages to replay')
+    parser.add_argument('--export-cache', metavar='CACHE_DB',
+                        help='write recordings from an HTTP cache database into --recordings and exit')
+    parser.add_argument('--latency', type=float, default=0.0, help='mean injected latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.5, help='latency jitter as a fraction of the mean')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with 500')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of requests answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--compress', action='store_true', help='honour Accept-Encoding (gzip/deflate)')
+    parser.add_argument('--listings-per-page', type=int, default=30)
+    parser.add_argument('--full-pages', type=int, default=2)
+    parser.add_argument('--overlap', type=float, default=0.3)
+    args = parser.parse_args()
+
+    if args.export_cache:
+        if not args.recordings:
+            parser.error('--export-cache needs --recordings')
+        logging.info(f"Exported recordings: {json.dumps(export_recordings(args.export_cache, args.recordings))}")
+    else:
+        logging.info(f"Serving fixtures on http://127.0.0.1:{args.port}")
+        serve(args.port, args.recordings,
+              dict(listings_per_page=args.listings_per_page, full_pages=args.full_pages, overlap=args.overlap),
+              dict(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                   throttle_rate=args.throttle_rate, retry_after=args.retry_after, compress=args.compress))
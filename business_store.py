@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import config
+import record_table
+
+NEW = 'new'
+CHANGED = 'changed'
+UNCHANGED = 'unchanged'
+VANISHED = 'vanished'
+
+# Fields that come from the search listing itself rather than from the
+# detail/gallery follow-ups (plus the per-query '{query}_rank' columns).
+LISTING_KEYS = (set(config.LISTING_FIELDS) - {'rank'}) | {'city', 'state', 'search_datetime'}
+# Fields that change on every sighting without the business changing.
+VOLATILE_KEYS = {'search_datetime'}
+
+
+def _uid_key(unique_id):
+    return json.dumps(list(unique_id))
+
+
+def _is_rank(key):
+    return key.endswith('_rank')
+
+
+def _digest(values):
+    return hashlib.sha1(json.dumps(values, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def listing_hash(info):
+    return _digest({key: info.get(key) for key in config.LISTING_FIELDS if key != 'rank'})
+
+
+def record_hash(record):
+    return _digest({key: value for key, value in record.items() if key not in VOLATILE_KEYS and not _is_rank(key)})
+
+
+def detail_fields(record):
+    return {key: value for key, value in record.items() if key not in LISTING_KEYS and not _is_rank(key)}
+
+
+class BusinessStore:
+    # Every business seen by earlier runs, keyed on (name, address) like
+    # transform(), with hashes of its listing and of the full record. A re-run
+    # reuses the stored detail/gallery fields when the listing is unchanged and
+    # the details are younger than BUSINESS_REFRESH_DAYS, and reports what is
+    # new, changed or gone to a delta writer.
+    def __init__(self, path=None, refresh_days=None):
+        path = config.BUSINESS_STORE_PATH if path is None else path
+        refresh_days = config.BUSINESS_REFRESH_DAYS if refresh_days is None else refresh_days
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.refresh_seconds = refresh_days * 86400
+        self.delta = None
+        self.run_started = None
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS businesses (
+                unique_id TEXT PRIMARY KEY,
+                yp_url TEXT,
+                city TEXT,
+                state TEXT,
+                listing_hash TEXT NOT NULL,
+                record_hash TEXT NOT NULL,
+                record TEXT NOT NULL,
+                status TEXT NOT NULL,
+                first_seen REAL NOT NULL,
+                last_seen REAL NOT NULL,
+                detailed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS businesses_last_seen ON businesses (last_seen);
+            CREATE TABLE IF NOT EXISTS run_locations (
+                city TEXT NOT NULL,
+                state TEXT NOT NULL,
+                PRIMARY KEY (city, state)
+            );
+        ''')
+        self.conn.commit()
+
+    def begin_run(self, resume=False):
+        # A resumed run keeps its start time so vanished businesses are still
+        # judged against the whole crawl.
+        started = self.conn.execute("SELECT value FROM meta WHERE key = 'run_started'").fetchone()
+        if resume and started:
+            self.run_started = float(started[0])
+        else:
+            self.run_started = time.time()
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('run_started', ?)", (str(self.run_started),))
+            self.conn.execute('DELETE FROM run_locations')
+            self.conn.commit()
+
+    def fresh_details(self, unique_id, info):
+        # Stored detail/gallery fields, or None if the business needs its
+        # follow-ups fetched again.
+        row = self.conn.execute('SELECT listing_hash, record, detailed_at FROM businesses WHERE unique_id = ?',
+                                (_uid_key(unique_id),)).fetchone()
+        if row is None or row[0] != listing_hash(info) or time.time() - row[2] > self.refresh_seconds:
+            return None
+        return detail_fields(json.loads(row[1]))
+
+    def record(self, unique_id, record, detailed=True):
+        key = _uid_key(unique_id)
+        now = time.time()
+        row = self.conn.execute('''
+            SELECT record_hash, status, first_seen, detailed_at, last_seen, record FROM businesses WHERE unique_id = ?
+        ''', (key,)).fetchone()
+        if row is not None and row[4] >= self.run_started:
+            # Found again after its record was written this run: fold the
+            # sightings together like compact_csv does for the export.
+            record = record_table.fold_record(json.loads(row[5]), record)
+        new_hash = record_hash(record)
+        if row is None or row[1] == VANISHED:
+            change = NEW
+        elif row[0] != new_hash:
+            change = CHANGED
+        else:
+            change = UNCHANGED
+        self.conn.execute('INSERT OR REPLACE INTO businesses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+            key, record.get('yp_url'), record.get('city'), record.get('state'), listing_hash(record), new_hash,
+            json.dumps(record, ensure_ascii=False), 'active', row[2] if row else now, now,
+            now if detailed or row is None else row[3]))
+        self.conn.execute('INSERT OR IGNORE INTO run_locations VALUES (?, ?)',
+                          (record.get('city') or '', record.get('state') or ''))
+        if change != UNCHANGED and self.delta is not None:
+            self.delta.write({**record, 'change': change})
+        return change
+
+    def finish_run(self):
+        # Businesses in the locations crawled this run that did not show up
+        # again. Only called after a complete crawl.
+        rows = self.conn.execute('''
+            SELECT unique_id, record FROM businesses b
+            WHERE status = 'active' AND last_seen < ?
+              AND EXISTS (SELECT 1 FROM run_locations l WHERE l.city = COALESCE(b.city, '') AND l.state = COALESCE(b.state, ''))
+        ''', (self.run_started,)).fetchall()
+        for key, data in rows:
+            if self.delta is not None:
+                self.delta.write({**json.loads(data), 'change': VANISHED})
+        self.conn.executemany("UPDATE businesses SET status = 'vanished' WHERE unique_id = ?",
+                              [(key,) for key, _ in rows])
+        self.conn.execute("DELETE FROM meta WHERE key = 'run_started'")
+        self.conn.commit()
+        return len(rows)
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
@@ -0,0 +1,163 @@
+import argparse
+import ast
+import logging
+import config
+import frontier
+
+# Command-line entry point. Only config and the frontier are imported up
+# front, so --help and --dry-run return immediately; the crawler and its
+# dependencies (aiohttp, lxml, ...) are imported once a crawl really starts.
+
+# Flags that set a config.py value directly: (flag, setting, type, choices, help)
+SETTINGS = (
+    ('--cities', 'CITIES_FILE_PATH', str, None, 'file with one "City, ST" per line'),
+    ('--queries', 'QUERIES_FILE_PATH', str, None, 'file with one search term per line'),
+    ('--page-limit', 'PAGE_LIMIT', int, None, 'search result pages per city/query'),
+    ('--concurrency', 'CONCURRENT_REQUESTS', int, None, 'crawl workers (requests in flight)'),
+    ('--export-format', 'EXPORT_FORMAT', str, ('csv', 'jsonl', 'parquet'), 'export file format'),
+    ('--exports-path', 'EXPORTS_PATH', str, None, 'directory for export files'),
+    ('--cache', 'CACHE_BACKEND', str, ('sqlite', 'memory'), 'HTTP response cache'),
+    ('--parser', 'PARSER_BACKEND', str, ('lxml', 'bs4'), 'HTML parser backend'),
+    ('--http-client', 'HTTP_CLIENT', str, ('aiohttp', 'httpx'), 'HTTP client (httpx = HTTP/2)'),
+    ('--metrics-port', 'METRICS_PORT', int, None, 'Prometheus endpoint port (0 disables it)'),
+)
+
+# Flags for the feature switches in config.py: (argument dest, setting)
+SWITCHES = (
+    ('incremental', 'INCREMENTAL'),
+    ('gallery_browser', 'GALLERY_BROWSER'),
+    ('download_images', 'DOWNLOAD_IMAGES'),
+    ('normalize', 'NORMALIZE_EXPORT'),
+)
+
+
+def setting_value(text):
+    # Python literals ('12', 'None', "('a', 'b')") or else the raw string.
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+
+def checked_value(current, text):
+    # (value, ok) for --set NAME=text, ok if the value fits the type of the
+    # current setting. None fits any setting and any value fits a None
+    # setting; ints pass for floats and text settings also take bare text.
+    value = setting_value(text)
+    if value is None or current is None:
+        return value, True
+    if isinstance(current, str):
+        return (value if isinstance(value, str) else text), True
+    if isinstance(current, float) and type(value) is int:
+        return float(value), True
+    return value, type(value) is type(current)
+
+
+def parse_args(argv=None, **defaults):
+    parser = argparse.ArgumentParser(description='Yellow pages scraper')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue the last interrupted crawl from its checkpoint')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='print how many URLs the crawl would request and exit')
+    parser.add_argument('--incremental', action='store_true', default=None,
+                        help='reuse recent details of unchanged businesses and write a delta export')
+    parser.add_argument('--coordinator', action='store_true',
+                        help='seed the shared work store, wait for workers and merge their results')
+    parser.add_argument('--worker', action='store_true', help='crawl batches leased from the shared work store')
+    parser.add_argument('--local-workers', type=int, default=0,
+                        help='with --coordinator, also start this many worker processes on this machine')
+    parser.add_argument('--gallery-browser', choices=('auto', 'never', 'always'),
+                        help='when to render gallery pages in a headless browser')
+    parser.add_argument('--download-images', action='store_true', default=None,
+                        help='download gallery images with thumbnails and add their paths and hashes to the export')
+    parser.add_argument('--normalize', action='store_true', default=None,
+                        help='also write a normalized copy of the export (E.164 phones, address parts, '
+                             'per-day hours, category lists, near-duplicates merged)')
+    parser.add_argument('--normalize-export', metavar='PATH',
+                        help='write the normalized copy of an existing export and exit')
+    for flag, setting, kind, choices, text in SETTINGS:
+        parser.add_argument(flag, dest=setting, type=kind, choices=choices,
+                            help=f"{text} (default: {getattr(config, setting)!r})")
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='override any config.py setting, e.g. --set RATE_LIMIT_MAX=20 (repeatable)')
+    parser.set_defaults(**defaults)
+    args = parser.parse_args(argv)
+    args.overrides = {setting: getattr(args, setting) for _, setting, _, _, _ in SETTINGS
+                      if getattr(args, setting) is not None}
+    # Switches only override config.py when given; --set comes last and wins.
+    for dest, setting in SWITCHES:
+        if getattr(args, dest) is not None:
+            args.overrides[setting] = getattr(args, dest)
+    for assignment in args.set:
+        name, equals, text = assignment.partition('=')
+        if not equals:
+            parser.error(f"--set: expected NAME=VALUE, got {assignment!r}")
+        if not name.isupper() or not hasattr(config, name):
+            parser.error(f"--set: unknown setting {name!r}")
+        value, ok = checked_value(getattr(config, name), text)
+        if not ok:
+            parser.error(f"--set: {name} must be of type {type(getattr(config, name)).__name__}, got {text!r}")
+        args.overrides[name] = value
+    return args
+
+
+def apply_settings(args):
+    for name, value in args.overrides.items():
+        setattr(config, name, value)
+    if config.METRICS_PORT == 0:
+        config.METRICS_PORT = None
+
+
+def worker_args(args):
+    # Flags that give locally started workers the coordinator's settings.
+    argv = []
+    for name, value in args.overrides.items():
+        argv += ['--set', f"{name}={value!r}"]
+    return argv
+
+
+def dry_run(coordinator=False):
+    cities = sum(1 for _ in frontier.iter_lines(config.CITIES_FILE_PATH))
+    queries = sum(1 for _ in frontier.iter_lines(config.QUERIES_FILE_PATH))
+    seeds = cities * queries
+    listings = seeds * config.PAGE_LIMIT * config.SEARCH_PAGE_SIZE
+    print(f"{cities} cities x {queries} queries = {seeds} search seeds")
+    print(f"Search pages: {seeds} to {seeds * config.PAGE_LIMIT} (page limit {config.PAGE_LIMIT}; "
+          f"a next page is only requested after a full one)")
+    print(f"Detail and gallery pages: up to {listings * 2} "
+          f"(2 per listing, {config.SEARCH_PAGE_SIZE} listings per page)")
+    if config.DOWNLOAD_IMAGES:
+        print(f"Gallery images: one download per image found, for up to {listings} galleries")
+    if coordinator:
+        batches = -(-cities // config.WORK_BATCH_CITIES)
+        print(f"Work batches: {batches} ({config.WORK_BATCH_CITIES} cities each)")
+    if seeds:
+        city = next(frontier.iter_lines(config.CITIES_FILE_PATH))
+        query = next(frontier.iter_lines(config.QUERIES_FILE_PATH))
+        print(f"First URL: {frontier.search_url(city, query, 1)}")
+
+
+def main(argv=None, **defaults):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_args(argv, **defaults)
+    apply_settings(args)
+    if args.dry_run:
+        dry_run(coordinator=args.coordinator)
+        return
+    if args.normalize_export:
+        import normalize
+        normalize.normalize_export(args.normalize_export)
+        return
+    import asyncio
+    import YPScraper
+    if args.worker:
+        asyncio.run(YPScraper.run_worker())
+    elif args.coordinator:
+        YPScraper.run_coordinator(resume=args.resume, local_workers=args.local_workers,
+                                  worker_args=worker_args(args))
+    else:
+        asyncio.run(YPScraper.main(resume=args.resume))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import json
+import os
+import sqlite3
+import time
+import config
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def _uid_key(unique_id):
+    return json.dumps(list(unique_id)) if unique_id is not None else ''
+
+
+def _uid_from_key(key):
+    return tuple(json.loads(key)) if key else None
+
+
+class CrawlJournal:
+    # Durable record of every search/detail/gallery task and of the records that
+    # are still waiting on follow-ups. Writes are grouped into periodic commits;
+    # callers only commit between handlers so the journal is always consistent.
+    def __init__(self, path=None, commit_interval=None):
+        path = config.JOURNAL_PATH if path is None else path
+        commit_interval = config.JOURNAL_COMMIT_INTERVAL if commit_interval is None else commit_interval
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.commit_interval = commit_interval
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS tasks (
+                url TEXT NOT NULL,
+                unique_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                retries INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (url, unique_id)
+            );
+            CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status);
+            CREATE TABLE IF NOT EXISTS records (
+                unique_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL
+            );
+        ''')
+        self.conn.commit()
+        self._last_commit = time.monotonic()
+
+    def reset(self):
+        self.conn.executescript('DELETE FROM meta; DELETE FROM tasks; DELETE FROM records;')
+        self.commit()
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        self.conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, json.dumps(value)))
+
+    def add_task(self, url, kind, unique_id=None):
+        self.conn.execute('''
+            INSERT INTO tasks (url, unique_id, kind, status, updated_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (url, unique_id) DO UPDATE SET status = excluded.status, updated_at = excluded.updated_at
+        ''', (url, _uid_key(unique_id), kind, PENDING, time.time()))
+
+    def finish_task(self, url, unique_id=None):
+        self.conn.execute('UPDATE tasks SET status = ?, updated_at = ? WHERE url = ? AND unique_id = ?',
+                          (DONE, time.time(), url, _uid_key(unique_id)))
+
+    def fail_task(self, url, unique_id=None):
+        self.conn.execute('''
+            UPDATE tasks SET status = ?, retries = retries + 1, updated_at = ?
+            WHERE url = ? AND unique_id = ?
+        ''', (FAILED, time.time(), url, _uid_key(unique_id)))
+
+    def pending_tasks(self, max_retries=None):
+        max_retries = config.JOURNAL_MAX_RETRIES if max_retries is None else max_retries
+        rows = self.conn.execute('''
+            SELECT url, kind, unique_id FROM tasks
+            WHERE status = ? OR (status = ? AND retries < ?)
+            ORDER BY rowid
+        ''', (PENDING, FAILED, max_retries))
+        return [(url, kind, _uid_from_key(key)) for url, kind, key in rows]
+
+    def task_counts(self, kind):
+        rows = self.conn.execute('SELECT status, COUNT(*) FROM tasks WHERE kind = ? GROUP BY status', (kind,))
+        return dict(rows.fetchall())
+
+    def save_record(self, unique_id, record):
+        self.conn.execute('INSERT OR REPLACE INTO records VALUES (?, ?)',
+                          (_uid_key(unique_id), json.dumps(record, ensure_ascii=False)))
+
+    def drop_record(self, unique_id):
+        self.conn.execute('DELETE FROM records WHERE unique_id = ?', (_uid_key(unique_id),))
+
+    def open_records(self):
+        for key, data in self.conn.execute('SELECT unique_id, data FROM records'):
+            yield _uid_from_key(key), json.loads(data)
+
+    def commit_due(self):
+        return time.monotonic() - self._last_commit >= self.commit_interval
+
+    def commit(self):
+        self.conn.commit()
+        self._last_commit = time.monotonic()
+
+    def close(self):
+        self.commit()
+        self.conn.close()
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from webdriver_manager.chrome import ChromeDriverManager
+import config
+
+logging.getLogger('webdriver_manager').setLevel(logging.ERROR)
+
+
+class PooledDriver:
+    __slots__ = ('driver', 'pages')
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+
+
+class DriverPool:
+    # Bounded pool of long-lived headless Chrome drivers. Drivers are created on
+    # demand up to `size`, health-checked on checkout and recycled after
+    # `max_pages` navigations. All blocking WebDriver calls run on a dedicated
+    # thread executor so async callers never block the event loop.
+    def __init__(self, size=None, max_pages=None):
+        size = config.DRIVER_POOL_SIZE if size is None else size
+        self.size = size
+        self.max_pages = config.DRIVER_MAX_PAGES if max_pages is None else max_pages
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='selenium')
+        self._slots = asyncio.Semaphore(size)
+        self._idle = []
+        self._driver_path = None
+        self._path_lock = asyncio.Lock()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def _resolve_driver_path(self):
+        async with self._path_lock:
+            if self._driver_path is None:
+                self._driver_path = await self._run(ChromeDriverManager().install)
+        return self._driver_path
+
+    def _create_driver(self, driver_path):
+        options = Options()
+        options.add_argument('--headless=new')
+        options.add_argument('--disable-gpu')
+        options.add_argument('--no-sandbox')
+        options.add_argument('--disable-dev-shm-usage')
+        options.add_argument(f'--user-agent={config.USER_AGENT}')
+        driver = webdriver.Chrome(service=Service(driver_path), options=options)
+        driver.set_page_load_timeout(config.DRIVER_PAGE_TIMEOUT)
+        return PooledDriver(driver)
+
+    @staticmethod
+    def _is_healthy(pooled):
+        try:
+            pooled.driver.execute_script('return 1')
+            return True
+        except WebDriverException:
+            return False
+
+    @staticmethod
+    def _quit(pooled):
+        try:
+            pooled.driver.quit()
+        except WebDriverException as e:
+            logging.warning(f"Error closing browser: {e}")
+
+    async def _checkout(self):
+        # Holding a slot caps live drivers at `size`: a new one is only started
+        # when no idle driver is left.
+        await self._slots.acquire()
+        try:
+            while self._idle:
+                pooled = self._idle.pop()
+                if await self._run(self._is_healthy, pooled):
+                    return pooled
+                logging.warning("Replacing unresponsive browser")
+                await self._run(self._quit, pooled)
+            return await self._run(self._create_driver, await self._resolve_driver_path())
+        except BaseException:
+            self._slots.release()
+            raise
+
+    @staticmethod
+    def _load(pooled, url):
+        pooled.driver.get(url)
+        pooled.pages += 1
+        return pooled.driver.page_source
+
+    async def fetch(self, url):
+        pooled = await self._checkout()
+        try:
+            content = await self._run(self._load, pooled, url)
+        except BaseException:
+            # The driver may be broken or still mid-navigation; drop it without waiting.
+            self._executor.submit(self._quit, pooled)
+            raise
+        else:
+            if pooled.pages >= self.max_pages:
+                self._executor.submit(self._quit, pooled)
+            else:
+                self._idle.append(pooled)
+        finally:
+            self._slots.release()
+        return content
+
+    async def close(self):
+        while self._idle:
+            await self._run(self._quit, self._idle.pop())
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,330 @@
+import csv
+import json
+import logging
+import os
+import config
+import images
+import record_table
+
+
+def export_columns(queries, with_images=False):
+    columns = sorted(f"{query}_rank" for query in queries) + config.DFCOL_ORDER
+    if with_images:
+        columns += images.COLUMNS
+    return columns
+
+
+class StreamingWriter:
+    # Buffers finished records and appends them to disk in row batches.
+    extension = None
+
+    def __init__(self, path, columns, batch_size=None, append=False):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.columns = list(columns)
+        self.batch_size = config.EXPORT_BATCH_SIZE if batch_size is None else batch_size
+        self.rows_written = 0
+        self._buffer = []
+        self._unknown_columns = set()
+        # Hashes of the (name, address) keys written so far; a business seen
+        # again after its row was flushed gets a second row, so compaction is
+        # only needed once a key repeats. Rows from before a resume are not in
+        # here, so a resumed writer sets _repeated to None and the compaction
+        # then finds the repeats itself.
+        self._keys = set()
+        self._repeated = set()
+
+    def write(self, record):
+        extra = record.keys() - set(self.columns) - self._unknown_columns
+        if extra:
+            self._unknown_columns.update(extra)
+            self._on_new_columns(sorted(extra))
+        self._buffer.append(record)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def _on_new_columns(self, columns):
+        logging.warning(f"Dropping columns not in export schema: {', '.join(columns)}")
+
+    def flush(self):
+        if self._buffer:
+            for record in self._buffer:
+                key = _key_hash(record)
+                if key in self._keys and self._repeated is not None:
+                    self._repeated.add(key)
+                self._keys.add(key)
+            self._write_batch(self._buffer)
+            self.rows_written += len(self._buffer)
+            self._buffer = []
+
+    def _write_batch(self, records):
+        raise NotImplementedError
+
+    def _close_file(self):
+        raise NotImplementedError
+
+    def _compact(self, repeated):
+        # Folds repeated businesses into one row and returns the rows removed.
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+        self._close_file()
+        if config.EXPORT_COMPACT and self._repeated != set():
+            self.rows_written -= self._compact(self._repeated)
+
+
+class CSVWriter(StreamingWriter):
+    extension = 'csv'
+
+    def __init__(self, path, columns, batch_size=None, append=False):
+        super().__init__(path, columns, batch_size, append)
+        resuming = append and os.path.exists(path) and os.path.getsize(path) > 0
+        self._file = open(path, 'a' if resuming else 'w', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=self.columns, extrasaction='ignore')
+        if resuming:
+            self._repeated = None
+        else:
+            self._writer.writeheader()
+            self._file.flush()
+
+    def _write_batch(self, records):
+        self._writer.writerows(records)
+        self._file.flush()
+
+    def _close_file(self):
+        self._file.close()
+
+    def _compact(self, repeated):
+        return compact_csv(self.path, self.columns, repeated)
+
+
+class JSONLWriter(StreamingWriter):
+    extension = 'jsonl'
+
+    def __init__(self, path, columns, batch_size=None, append=False):
+        super().__init__(path, columns, batch_size, append)
+        if append and os.path.exists(path) and os.path.getsize(path) > 0:
+            self._repeated = None
+        self._file = open(path, 'a' if append else 'w', encoding='utf-8')
+
+    def _on_new_columns(self, columns):
+        # JSONL rows are self-describing, so the schema simply grows.
+        self.columns.extend(columns)
+
+    def _write_batch(self, records):
+        self._file.writelines(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+        self._file.flush()
+
+    def _close_file(self):
+        self._file.close()
+
+    def _compact(self, repeated):
+        return compact_jsonl(self.path, self.columns, repeated)
+
+
+class ParquetWriter(StreamingWriter):
+    extension = 'parquet'
+
+    def __init__(self, path, columns, batch_size=None, append=False):
+        # Parquet files cannot be appended to and are only readable once closed,
+        # so the export is a series of part files: <name>.parquet,
+        # <name>.part1.parquet, ... A new part is started every
+        # EXPORT_PARQUET_PART_BATCHES batches, so finished parts can be read
+        # while the crawl runs, and by a resumed run.
+        self._root = path.rsplit('.part', 1)[0].rsplit('.parquet', 1)[0]
+        self._append = append
+        self.paths = []
+        path = self._next_path()
+        super().__init__(path, columns, batch_size, append)
+        self._schema = record_table.arrow_schema(self.columns)
+        self._open_part(path)
+
+    def _next_path(self):
+        path, part = f"{self._root}.parquet", 1
+        while (self._append or self.paths) and os.path.exists(path):
+            path = f"{self._root}.part{part}.parquet"
+            part += 1
+        return path
+
+    def _open_part(self, path):
+        import pyarrow.parquet as pq
+        self._writer = pq.ParquetWriter(path, self._schema)
+        self._batches = 0
+        self.paths.append(path)
+
+    def _write_batch(self, records):
+        if config.EXPORT_PARQUET_PART_BATCHES and self._batches >= config.EXPORT_PARQUET_PART_BATCHES:
+            self._writer.close()
+            self._open_part(self._next_path())
+        table = record_table.RecordTable(self.columns)
+        for record in records:
+            table.add(record)
+        self._writer.write_table(table.to_arrow(self.columns))
+        self._batches += 1
+        # Repeats inside one batch are already folded into a single row.
+        self.rows_written -= len(records) - len(table)
+
+    def _close_file(self):
+        self._writer.close()
+
+    def _compact(self, repeated):
+        return compact_parquet(self.paths, self.columns, repeated)
+
+
+WRITERS = {writer.extension: writer for writer in (CSVWriter, JSONLWriter, ParquetWriter)}
+
+
+def export_path(filename_base, export_format=None):
+    # The export's own path; Parquet exports continue in part files next to it.
+    export_format = config.EXPORT_FORMAT if export_format is None else export_format
+    if export_format not in WRITERS:
+        raise ValueError(f"Unknown export format: {export_format}")
+    return os.path.join(config.EXPORTS_PATH, f"{filename_base}.{WRITERS[export_format].extension}")
+
+
+def open_writer(filename_base, columns, export_format=None, append=False):
+    export_format = config.EXPORT_FORMAT if export_format is None else export_format
+    path = export_path(filename_base, export_format)
+    return WRITERS[export_format](path, columns, append=append)
+
+
+def _key_hash(record):
+    return hash((record.get('name'), record.get('address')))
+
+
+def _read_rows(path):
+    # (header, (name, address), row) for every CSV row, rows as plain lists.
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        if 'name' not in header or 'address' not in header:
+            return
+        name, address = header.index('name'), header.index('address')
+        for row in reader:
+            yield header, (row[name], row[address]), row
+
+
+def compact_csv(path, columns, repeated=None):
+    # A business seen again after its row was flushed gets a second row; fold
+    # those together with non-empty values winning, as fold_record does. Only the
+    # repeated businesses are held in memory: one pass collects them (unless
+    # the writer already knows their key hashes), a second merges them and a
+    # third rewrites the file with each merged row where it first appeared.
+    # Returns the number of rows folded away.
+    if repeated is None:
+        seen, repeated = set(), set()
+        for _, unique_id, _ in _read_rows(path):
+            key = hash(unique_id)
+            if key in seen:
+                repeated.add(key)
+            seen.add(key)
+        del seen
+    if not repeated:
+        return 0
+    table = record_table.RecordTable(columns)
+    for header, unique_id, row in _read_rows(path):
+        if hash(unique_id) in repeated:
+            table.add(dict(zip(header, row)))
+    written, removed = set(), 0
+    with open(f"{path}.tmp", 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for header, unique_id, row in _read_rows(path):
+            if hash(unique_id) in repeated:
+                if unique_id in written:
+                    removed += 1
+                    continue
+                written.add(unique_id)
+                record = table.get(unique_id)
+            elif header != columns:
+                record = dict(zip(header, row))
+            else:
+                writer.writerow(row)
+                continue
+            writer.writerow([record.get(column) for column in columns])
+    os.replace(f"{path}.tmp", path)
+    return removed
+
+
+def _folded(records, repeated):
+    # Merged copies of the repeated businesses among records.
+    table = record_table.RecordTable([])
+    for record in records:
+        if _key_hash(record) in repeated:
+            table.add(record)
+    return table
+
+
+def _read_jsonl(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def compact_jsonl(path, columns, repeated=None):
+    # Same three passes as compact_csv, over JSON lines.
+    if repeated is None:
+        seen, repeated = set(), set()
+        for record in _read_jsonl(path):
+            key = _key_hash(record)
+            if key in seen:
+                repeated.add(key)
+            seen.add(key)
+        del seen
+    if not repeated:
+        return 0
+    table = _folded(_read_jsonl(path), repeated)
+    written, removed = set(), 0
+    with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+        for record in _read_jsonl(path):
+            if _key_hash(record) in repeated:
+                unique_id = (record.get('name'), record.get('address'))
+                if unique_id in written:
+                    removed += 1
+                    continue
+                written.add(unique_id)
+                record = {key: value for key, value in table.get(unique_id).items() if value is not None}
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    os.replace(f"{path}.tmp", path)
+    return removed
+
+
+def compact_parquet(paths, columns, repeated):
+    # Same as compact_csv across the part files one writer produced, rewriting
+    # the parts that hold repeated businesses one row group at a time with the
+    # writer's schema. The writer always knows the repeated keys, since a
+    # resumed run starts a new part file; parts from before a resume are left
+    # alone, so a business re-seen after a resume can have a row in each.
+    if not repeated:
+        return 0
+    import pyarrow.parquet as pq
+
+    def records(path):
+        for batch in pq.ParquetFile(path).iter_batches():
+            yield from batch.to_pylist()
+
+    affected = [path for path in paths if any(_key_hash(record) in repeated for record in records(path))]
+    table = _folded((record for path in affected for record in records(path)), repeated)
+    written, removed = set(), 0
+    schema = record_table.arrow_schema(columns)
+    for path in affected:
+        with pq.ParquetWriter(f"{path}.tmp", schema) as writer:
+            for batch in pq.ParquetFile(path).iter_batches():
+                rows = record_table.RecordTable(columns)
+                for record in batch.to_pylist():
+                    if _key_hash(record) in repeated:
+                        unique_id = (record.get('name'), record.get('address'))
+                        if unique_id in written:
+                            removed += 1
+                            continue
+                        written.add(unique_id)
+                        record = table.get(unique_id)
+                    rows.add(record)
+                if len(rows):
+                    writer.write_table(rows.to_arrow(columns))
+        os.replace(f"{path}.tmp", path)
+    return removed
@@ -0,0 +1,65 @@
+import itertools
+import logging
+from urllib.parse import quote, urlparse, parse_qsl
+import config
+
+
+def iter_lines(file_path):
+    # Streams non-empty lines, so city lists of any size stay out of memory.
+    try:
+        with open(file_path, 'r') as file:
+            for line in file:
+                line = line.strip()
+                if line:
+                    yield line
+    except IOError as e:
+        logging.error(f"File error: {e}")
+
+
+def iter_seeds(cities, queries_path):
+    # Every city x query pair; the queries file is re-read per city instead of
+    # holding the product (or either list) in memory.
+    for city in cities:
+        for query in iter_lines(queries_path):
+            yield city, query
+
+
+def search_url(city, query, page, domain=None):
+    return f'{domain or config.DOMAIN}/search?search_terms={query}&geo_location_terms={quote(city)}&page={page}'
+
+
+def page_of(url):
+    return int(dict(parse_qsl(urlparse(url).query)).get('page', 1))
+
+
+class SearchFrontier:
+    # Yields search pages on demand. Each city x query seed starts at page 1 and
+    # only gets page N+1 once page N came back full; callers keep a bounded
+    # number of such chains running and start the next seed when one ends.
+    def __init__(self, seeds, page_limit=None, page_size=None, skip=0):
+        self.seeds = itertools.islice(seeds, skip, None)
+        self.page_limit = config.PAGE_LIMIT if page_limit is None else page_limit
+        self.page_size = config.SEARCH_PAGE_SIZE if page_size is None else page_size
+        self.issued = skip
+        self.exhausted = False
+
+    def next_seed(self):
+        seed = next(self.seeds, None)
+        if seed is None:
+            self.exhausted = True
+            return None
+        self.issued += 1
+        return search_url(*seed, 1)
+
+    def next_page(self, url, listings):
+        # Returns (next page url or None, reason the chain stopped).
+        if listings is None:
+            return None, 'failed'
+        if not listings:
+            return None, 'empty'
+        if len(listings) < self.page_size:
+            return None, 'short'
+        page = page_of(url)
+        if page >= self.page_limit:
+            return None, 'page_limit'
+        return f"{url[:url.rindex('&page=')]}&page={page + 1}", None
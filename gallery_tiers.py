@@ -0,0 +1,55 @@
+import json
+import logging
+import os
+import re
+from urllib.parse import urlparse
+import config
+
+HTTP = 'http'
+BROWSER = 'browser'
+
+
+def url_pattern(url):
+    # Keep structural path words, collapse city/business slugs:
+    # '/austin-tx/mip/joes-plumbing-123/photos' -> 'host/*/mip/*/photos'
+    parsed = urlparse(url)
+    segments = parsed.path.strip('/').split('/')
+    return '/'.join([parsed.netloc] + [segment if re.fullmatch(r'[a-z]+', segment) else '*' for segment in segments])
+
+
+class GalleryTierMemory:
+    # Per URL pattern, counts which tier actually produced gallery images.
+    # Once plain HTTP has clearly stopped working for a pattern we go straight
+    # to the browser, re-probing HTTP every GALLERY_TIER_REPROBE pages.
+    def __init__(self, path):
+        self.path = path
+        self.stats = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r') as file:
+                    self.stats = json.load(file)
+            except (IOError, ValueError) as e:
+                logging.warning(f"Ignoring unreadable gallery tier memory {path}: {e}")
+
+    def _counts(self, url):
+        return self.stats.setdefault(url_pattern(url), {HTTP: 0, BROWSER: 0, 'skipped': 0})
+
+    def should_try_http(self, url):
+        counts = self._counts(url)
+        seen = counts[HTTP] + counts[BROWSER]
+        if seen < config.GALLERY_TIER_SAMPLE or counts[HTTP] / seen >= config.GALLERY_HTTP_MIN_SUCCESS:
+            return True
+        counts['skipped'] += 1
+        return counts['skipped'] % config.GALLERY_TIER_REPROBE == 0
+
+    def record(self, url, tier):
+        self._counts(url)[tier] += 1
+
+    def save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(self.path, 'w') as file:
+            json.dump(self.stats, file, indent=2)
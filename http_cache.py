@@ -0,0 +1,191 @@
+import hashlib
+import os
+import sqlite3
+import time
+import zlib
+from collections import OrderedDict
+from urllib.parse import urlparse
+import config
+
+
+class CacheEntry:
+    __slots__ = ('body', 'etag', 'last_modified', 'fetched_at')
+
+    def __init__(self, body, etag=None, last_modified=None, fetched_at=None):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at if fetched_at is not None else time.time()
+
+    def is_fresh(self, ttl):
+        return time.time() - self.fetched_at < ttl
+
+    def revalidation_headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+def url_class(url):
+    path = urlparse(url).path
+    if path.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp')):
+        return 'image'
+    if path.startswith('/search'):
+        return 'search'
+    if '/photos' in path or '/gallery' in path:
+        return 'gallery'
+    return 'detail'
+
+
+def ttl_for(url):
+    return config.CACHE_TTLS.get(url_class(url), 0)
+
+
+class MemoryCache:
+    # In-process LRU bounded by total body size; nothing survives the run.
+    def __init__(self, max_bytes=None):
+        self.max_bytes = config.CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+
+    def get(self, url):
+        entry = self._entries.get(url)
+        if entry is not None:
+            self._entries.move_to_end(url)
+        return entry
+
+    def set(self, url, entry):
+        old = self._entries.pop(url, None)
+        if old is not None:
+            self.size -= len(old.body)
+        self._entries[url] = entry
+        self.size += len(entry.body)
+        while self.size > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted.body)
+
+    def touch(self, url):
+        entry = self._entries.get(url)
+        if entry is not None:
+            entry.fetched_at = time.time()
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def close(self):
+        pass
+
+
+class SQLiteCache:
+    # Compressed response bodies keyed by URL hash, with LRU eviction on a size cap.
+    def __init__(self, path=None, max_bytes=None, compression_level=None):
+        path = config.CACHE_PATH if path is None else path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.max_bytes = config.CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.compression_level = config.CACHE_COMPRESSION_LEVEL if compression_level is None else compression_level
+        # Shared by every worker process of a distributed crawl on this machine.
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)')
+        self.conn.commit()
+        self.size = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        # LRU timestamps from reads are written with the next commit, so a read
+        # never leaves a write transaction open (which would lock out other
+        # processes sharing the file).
+        self._accessed = {}
+
+    @staticmethod
+    def _key(url):
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def get(self, url):
+        key = self._key(url)
+        row = self.conn.execute(
+            'SELECT body, etag, last_modified, fetched_at FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        self._accessed[key] = time.time()
+        if len(self._accessed) >= 256:
+            self._commit()
+        body = zlib.decompress(row[0]).decode('utf-8')
+        return CacheEntry(body, row[1], row[2], row[3])
+
+    def set(self, url, entry):
+        key = self._key(url)
+        blob = zlib.compress(entry.body.encode('utf-8'), self.compression_level)
+        old = self.conn.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+        if old:
+            self.size -= old[0]
+        self.conn.execute(
+            'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (key, url, blob, len(blob), entry.etag, entry.last_modified, entry.fetched_at, time.time()))
+        self.size += len(blob)
+        if self.size > self.max_bytes:
+            self._flush_accessed()
+            self._evict()
+        self._commit()
+
+    def touch(self, url):
+        now = time.time()
+        self.conn.execute('UPDATE responses SET fetched_at = ?, accessed_at = ? WHERE key = ?',
+                          (now, now, self._key(url)))
+        self._commit()
+
+    def _flush_accessed(self):
+        if self._accessed:
+            self.conn.executemany('UPDATE responses SET accessed_at = ? WHERE key = ?',
+                                  [(accessed_at, key) for key, accessed_at in self._accessed.items()])
+            self._accessed.clear()
+
+    def _commit(self):
+        self._flush_accessed()
+        self.conn.commit()
+
+    def _evict(self):
+        # Drop least recently used rows until we are 10% under the cap.
+        target = self.max_bytes * 0.9
+        rows = self.conn.execute('SELECT key, size FROM responses ORDER BY accessed_at')
+        stale = []
+        for key, size in rows:
+            if self.size <= target:
+                break
+            stale.append((key,))
+            self.size -= size
+        self.conn.executemany('DELETE FROM responses WHERE key = ?', stale)
+
+    def clear(self):
+        self._accessed.clear()
+        self.conn.execute('DELETE FROM responses')
+        self.conn.commit()
+        self.size = 0
+
+    def close(self):
+        self._commit()
+        self.conn.close()
+
+
+def open_cache(backend=None):
+    backend = config.CACHE_BACKEND if backend is None else backend
+    if backend == 'sqlite':
+        return SQLiteCache()
+    if backend == 'memory':
+        return MemoryCache()
+    raise ValueError(f"Unknown cache backend: {backend}")
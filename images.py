@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urljoin, urlparse
+import config
+import rate_limit
+
+COLUMNS = ['space_image_paths', 'space_image_thumbnails', 'space_image_hashes']
+EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+
+
+class ImageFile:
+    __slots__ = ('url', 'sha256', 'path', 'thumbnail', 'source')
+
+    def __init__(self, url, sha256, path, thumbnail, source):
+        self.url = url
+        self.sha256 = sha256
+        self.path = path
+        self.thumbnail = thumbnail
+        # 'downloaded', 'duplicate' (bytes already stored under another URL) or 'indexed'
+        self.source = source
+
+
+def image_urls(space_image, page_url):
+    # space_image is the comma-joined src list from the gallery page; srcs
+    # may be relative to it.
+    urls = []
+    for src in (space_image or '').split(', '):
+        url = urljoin(page_url, src.strip()) if src.strip() else None
+        if url and url not in urls:
+            urls.append(url)
+    return urls
+
+
+def image_columns(files):
+    return {
+        'space_image_paths': ', '.join(file.path for file in files),
+        'space_image_thumbnails': ', '.join(file.thumbnail or '' for file in files),
+        'space_image_hashes': ', '.join(file.sha256 for file in files),
+    }
+
+
+def extension_of(url):
+    extension = os.path.splitext(urlparse(url).path)[1].lower()
+    return extension if extension in EXTENSIONS else '.img'
+
+
+def content_path(root, sha256, extension):
+    return os.path.join(root, sha256[:2], sha256 + extension)
+
+
+def make_thumbnail(source, target, size):
+    from PIL import Image
+    with Image.open(source) as image:
+        image.thumbnail((size, size))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        image.convert('RGB').save(f"{target}.tmp", 'JPEG', quality=85)
+    os.replace(f"{target}.tmp", target)
+
+
+def store_download(part_path, root, extension, thumbnail_size):
+    # Runs in the image process pool: hash the finished download, move it to
+    # its content address (or drop it when those bytes are already stored)
+    # and thumbnail it.
+    sha256 = hashlib.sha256()
+    with open(part_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    digest = sha256.hexdigest()
+    path = content_path(root, digest, extension)
+    duplicate = os.path.exists(path)
+    if duplicate:
+        os.remove(part_path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(part_path, path)
+    thumbnail = None
+    if thumbnail_size:
+        thumbnail = content_path(os.path.join(root, 'thumbnails'), digest, '.jpg')
+        if not os.path.exists(thumbnail):
+            try:
+                make_thumbnail(path, thumbnail, thumbnail_size)
+            except (OSError, ValueError) as e:
+                logging.warning(f"Could not thumbnail {path}: {e}")
+                thumbnail = None
+    return digest, path, thumbnail, duplicate
+
+
+class ImagePipeline:
+    # Downloads gallery images alongside the crawl, IMAGE_CONCURRENCY at a
+    # time. Files are stored once per content hash under `root`; the index
+    # maps each URL to its file so an image is fetched once across runs.
+    # Interrupted downloads stay in root/partial and continue with a Range
+    # request on the next attempt or run.
+    def __init__(self, limiter, thumbnail_size, root=None, index_path=None, concurrency=None, workers=None):
+        root = config.IMAGES_PATH if root is None else root
+        index_path = config.IMAGE_INDEX_PATH if index_path is None else index_path
+        concurrency = config.IMAGE_CONCURRENCY if concurrency is None else concurrency
+        workers = config.IMAGE_WORKERS if workers is None else workers
+        if thumbnail_size:
+            try:
+                import PIL
+            except ImportError:
+                raise ImportError("Image thumbnails require Pillow (pip install Pillow)")
+        self.limiter = limiter
+        self.root = root
+        self.partial = os.path.join(root, 'partial')
+        os.makedirs(self.partial, exist_ok=True)
+        directory = os.path.dirname(index_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.thumbnail_size = thumbnail_size
+        self.slots = asyncio.Semaphore(concurrency)
+        self.pool = ProcessPoolExecutor(max_workers=workers) if workers else None
+        # Shared by every worker process of a distributed crawl on this machine.
+        self.conn = sqlite3.connect(index_path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS images (
+                url TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                path TEXT NOT NULL,
+                thumbnail TEXT,
+                fetched_at REAL NOT NULL
+            )
+        ''')
+        self.conn.commit()
+
+    def lookup(self, url):
+        row = self.conn.execute('SELECT sha256, path, thumbnail FROM images WHERE url = ?', (url,)).fetchone()
+        if row is None or not os.path.exists(row[1]):
+            return None
+        return ImageFile(url, row[0], row[1], row[2], 'indexed')
+
+    async def fetch(self, url, session):
+        image = self.lookup(url)
+        if image is not None:
+            return image
+        part = os.path.join(self.partial, hashlib.sha1(url.encode('utf-8')).hexdigest())
+        async with self.slots:
+            if not await self._download(url, part, session):
+                return None
+        if self.pool is None:
+            stored = store_download(part, self.root, extension_of(url), self.thumbnail_size)
+        else:
+            stored = await asyncio.get_running_loop().run_in_executor(
+                self.pool, store_download, part, self.root, extension_of(url), self.thumbnail_size)
+        digest, path, thumbnail, duplicate = stored
+        self.conn.execute('INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?)',
+                          (url, digest, path, thumbnail, time.time()))
+        # Committed right away so the write lock is never held across downloads.
+        self.conn.commit()
+        return ImageFile(url, digest, path, thumbnail, 'duplicate' if duplicate else 'downloaded')
+
+    async def _download(self, url, part, session):
+        for attempt in range(config.MAX_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(rate_limit.backoff_delay(attempt))
+            await self.limiter.acquire(url)
+            offset = os.path.getsize(part) if os.path.exists(part) else 0
+            start = time.monotonic()
+            try:
+                with open(part, 'ab') as file:
+                    status = await session.download(url, file, offset)
+            except session.errors as e:
+                # Whatever arrived stays in the partial file for the next attempt.
+                self.limiter.record_error(url, e)
+                logging.warning(f"Image download error for {url} (attempt {attempt + 1}): {e}")
+                continue
+            if status in config.RETRY_STATUSES:
+                self.limiter.record_throttle(url, status, None)
+                continue
+            if status == 416 and offset:
+                # Nothing left after offset: the previous attempt got it all.
+                status = 206
+            if status >= 400:
+                logging.error(f"Image download error for {url}: HTTP {status}")
+                os.remove(part)
+                return False
+            self.limiter.record_success(url, time.monotonic() - start)
+            return True
+        logging.error(f"Giving up on image {url} after {config.MAX_RETRIES + 1} attempts")
+        return False
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+        self.conn.commit()
+        self.conn.close()
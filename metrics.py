@@ -0,0 +1,191 @@
+import json
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+import config
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation.
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+class Metrics:
+    # In-process counters, gauges and histograms keyed by (name, labels).
+    # Gauge functions are evaluated on read, for values the crawler already
+    # tracks elsewhere (queue depth, per-host rate).
+    def __init__(self, prefix='ypscraper', buckets=None):
+        self.prefix = prefix
+        self.buckets = config.METRICS_BUCKETS if buckets is None else buckets
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.gauge_functions = {}
+        self.started_at = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        self.gauges[(name, _label_key(labels))] = value
+
+    def add(self, name, delta, **labels):
+        key = (name, _label_key(labels))
+        self.gauges[key] = self.gauges.get(key, 0) + delta
+
+    def gauge_function(self, name, func, label=None):
+        # func returns a number, or {label_value: number} when label is given.
+        self.gauge_functions[name] = (func, label)
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter(self, name, **labels):
+        # Sum over all label sets matching the given labels.
+        wanted = set(_label_key(labels))
+        return sum(value for (metric, key), value in self.counters.items()
+                   if metric == name and wanted <= set(key))
+
+    def _gauge_values(self):
+        values = dict(self.gauges)
+        for name, (func, label) in self.gauge_functions.items():
+            try:
+                result = func()
+            except Exception as e:
+                logging.debug(f"Gauge {name} unavailable: {e}")
+                continue
+            if label is None:
+                values[(name, ())] = result
+            else:
+                for label_value, value in result.items():
+                    values[(name, ((label, str(label_value)),))] = value
+        return values
+
+    def render(self):
+        lines = []
+        typed = set()
+
+        def type_line(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {self.prefix}_{name} {kind}")
+
+        for (name, key), value in sorted(self.counters.items()):
+            type_line(name, 'counter')
+            lines.append(f"{self.prefix}_{name}{_format_labels(key)} {value}")
+        for (name, key), value in sorted(self._gauge_values().items()):
+            type_line(name, 'gauge')
+            lines.append(f"{self.prefix}_{name}{_format_labels(key)} {value}")
+        for (name, key), histogram in sorted(self.histograms.items()):
+            type_line(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f"{self.prefix}_{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.prefix}_{name}_bucket{_format_labels(key, [('le', '+Inf')])} {histogram.count}")
+            lines.append(f"{self.prefix}_{name}_sum{_format_labels(key)} {histogram.sum}")
+            lines.append(f"{self.prefix}_{name}_count{_format_labels(key)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    def summary(self, **extra):
+        def series(name, key):
+            return f"{name}{_format_labels(key)}"
+
+        histograms = {}
+        for (name, key), histogram in sorted(self.histograms.items()):
+            histograms[series(name, key)] = {
+                'count': histogram.count,
+                'sum': round(histogram.sum, 4),
+                'mean': round(histogram.sum / histogram.count, 6) if histogram.count else None,
+                'p50': histogram.quantile(0.5),
+                'p90': histogram.quantile(0.9),
+                'p99': histogram.quantile(0.99),
+            }
+        return {
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started_at)),
+            'elapsed_s': round(time.time() - self.started_at, 3),
+            **extra,
+            'counters': {series(name, key): value for (name, key), value in sorted(self.counters.items())},
+            'gauges': {series(name, key): value for (name, key), value in sorted(self._gauge_values().items())},
+            'histograms': histograms,
+        }
+
+    def write_summary(self, path, **extra):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(path, 'w') as file:
+            json.dump(self.summary(**extra), file, indent=2, default=str)
+
+    async def serve(self, host, port):
+        # GET /metrics (Prometheus text format) and /metrics.json. Returns the
+        # runner to stop later, or None if the port could not be bound.
+        from aiohttp import web
+
+        async def prometheus(request):
+            return web.Response(text=self.render(), content_type='text/plain', charset='utf-8')
+
+        async def summary(request):
+            return web.json_response(self.summary(), dumps=lambda data: json.dumps(data, default=str))
+
+        app = web.Application()
+        app.router.add_get('/metrics', prometheus)
+        app.router.add_get('/metrics.json', summary)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, host, port).start()
+        except OSError as e:
+            logging.warning(f"Metrics endpoint disabled, cannot listen on {host}:{port}: {e}")
+            await runner.cleanup()
+            return None
+        logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+        return runner
@@ -0,0 +1,328 @@
+import glob
+import logging
+import os
+import time
+import config
+
+# Batch clean-up of a finished export. The crawl writes fields the way the
+# page shows them ('(512) 555-0100', 'Mon - Fri: 8:00 am - 5:00 pm, ...');
+# this stage parses them once for the whole file with pandas string ops
+# instead of leaving every consumer to re-parse them row by row. The raw
+# columns are kept and the parsed ones are added after them. pandas is only
+# imported here, when an export is normalized.
+#
+# Patterns are plain strings without lookarounds so that pandas can hand them
+# to pyarrow's regex engine when the columns are Arrow-backed; the ones that
+# need Python's re only ever see the distinct values of a column.
+
+DAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+HOURS_COLUMNS = [f"hours_{day}" for day in DAYS]
+NORMALIZED_COLUMNS = ['phone_e164', 'fax_e164', 'extra_phones_e164', 'email_normalized',
+                      'address_street', 'address_city', 'address_state', 'address_zip',
+                      'category_list'] + HOURS_COLUMNS
+# Separator for list columns in CSV files (JSONL and Parquet keep real lists)
+LIST_SEPARATOR = '|'
+
+# US (NANP) numbers only, like the site: area code and exchange never start with 0 or 1
+NANP_NUMBER = r'[2-9]\d{2}[2-9]\d{6}'
+PHONE_NUMBER = r'(?:\+?1[\s.-]*)?\(?\b([2-9]\d{2})\)?[\s.-]*([2-9]\d{2})[\s.-]*(\d{4})\b'
+EMAIL = r'[^@\s]+@[^@\s]+\.[a-z]{2,}'
+# 'street, city, ST 12345'; the street may itself contain commas or be missing
+ADDRESS = (r'^\s*(?:(?P<street>.+?)\s*,\s*)?(?P<city>[^,]+?)\s*,\s*(?P<state>[A-Za-z]{2})'
+           r'(?:\s+(?P<zip>\d{5})(?:-\d{4})?)?\s*$')
+CATEGORY_SEPARATOR = r'\s*,\s*'
+
+DAY_NAME = r'(?:mon|tue|wed|thu|fri|sat|sun)[a-z]*\.?'
+# One 'Mon - Fri: <hours>' entry of detailed_hours; the hours run up to the next day label
+HOURS_ENTRY = (rf'(?i)(?P<first>{DAY_NAME})(?:\s*-\s*(?P<last>{DAY_NAME}))?\s*:\s*(?P<hours>.*?)\s*,?\s*'
+               rf'(?={DAY_NAME}(?:\s*-\s*{DAY_NAME})?\s*:|$)')
+TIME = r'(?i)(?P<hour>\d{1,2})(?::(?P<minute>\d{2}))?\s*(?:(?P<meridiem>[ap])\.?m\b\.?)?'
+OPEN_ALL_DAY = r'(?i)24\s*h(?:ou)?rs?'
+CLOSED = r'(?i)closed'
+
+# Fuzzy dedup keys: names and streets are reduced to their distinctive words
+# so 'Joe's Pizza, Inc.' at '12 Main Street' matches 'Joes Pizza' at
+# '12 Main St., Suite 4'. Street types and directions are dropped in both
+# their long and short forms rather than abbreviated word by word.
+NAME_NOISE = r'(?:\b(?:the|inc|llc|co|corp|corporation|company|ltd|pllc|pc)\b|[^a-z0-9])+'
+STREET_NOISE = (r'(?:\b(?:suite|ste|unit|apt|fl|floor|bldg|rm|room)\b|#)\.?\s*[\w-]+|'
+                r'\b(?:street|st|avenue|ave|av|road|rd|boulevard|blvd|drive|dr|lane|ln|court|ct|place|pl|'
+                r'parkway|pkwy|highway|hwy|circle|cir|terrace|ter|square|sq|trail|trl|'
+                r'north|n|south|s|east|e|west|w|northeast|ne|northwest|nw|southeast|se|southwest|sw)\b')
+NON_ALNUM = r'[^a-z0-9]+'
+
+
+def _pandas():
+    try:
+        import pandas
+    except ImportError:
+        raise ImportError("Export normalization requires pandas (pip install pandas)")
+    return pandas
+
+
+def _has_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        return False
+    return True
+
+
+def _mask(values):
+    # Boolean Series from a str.* result that may hold missing values.
+    return values.fillna(False).astype(bool)
+
+
+def _present(series):
+    return series.where(_mask(series.str.len() > 0))
+
+
+def per_unique(series, parse):
+    # Runs parse over the distinct values only and spreads the result back;
+    # fields like detailed_hours repeat the same few strings across the export.
+    pd = _pandas()
+    codes, uniques = pd.factorize(series)
+    parsed = parse(pd.Series(uniques, dtype=object))
+    return parsed.reindex(codes).set_axis(series.index)
+
+
+def _squash(series):
+    return series.str.replace(NON_ALNUM, ' ', regex=True).str.strip()
+
+
+def e164(series):
+    digits = series.str.replace(r'\D+', '', regex=True).str.replace(r'^1(\d{10})$', r'\1', regex=True)
+    return ('+1' + digits).where(_mask(digits.str.fullmatch(NANP_NUMBER)))
+
+
+def extra_phones(series):
+    # (E.164 number lists, the fax number) from 'Fax: (512) 555-0100 Toll Free: ...':
+    # every number is rewritten in place, then the label words are dropped.
+    tagged = series.str.replace(PHONE_NUMBER, r' +1\1\2\3 ', regex=True)
+    fax = tagged.str.replace(r'(?i)^.*?\bfax\s*:\s*(\+1\d{10}) .*$', r'\1', regex=True)
+    fax = fax.where(_mask(fax.str.fullmatch(r'\+1\d{10}')))
+    numbers = tagged.str.replace(r'[^+]*(\+1\d{10})[^+]*', r'\1 ', regex=True).str.strip()
+    numbers = numbers.where(_mask(tagged.str.contains('+1', regex=False)))
+    return numbers.str.split(' '), fax
+
+
+def emails(series):
+    cleaned = series.str.strip().str.lower().str.replace(r'^mailto:|\?.*$', '', regex=True)
+    return cleaned.where(_mask(cleaned.str.fullmatch(EMAIL)))
+
+
+def address_parts(series):
+    parts = series.str.extract(ADDRESS)
+    parts['state'] = parts['state'].str.upper()
+    return parts
+
+
+def category_lists(series):
+    return series.str.strip().str.replace(CATEGORY_SEPARATOR, LIST_SEPARATOR, regex=True).str.split(LIST_SEPARATOR)
+
+
+def _clock(hour, minute):
+    return hour.astype(int).astype(str).str.zfill(2) + ':' + minute.astype(str).str.zfill(2)
+
+
+def hours_columns(series):
+    # One column per weekday holding 24-hour ranges ('08:00-12:00,13:00-17:00'),
+    # '00:00-24:00' for open around the clock, or 'closed'.
+    pd = _pandas()
+    entries = series.str.extractall(HOURS_ENTRY)
+    first = entries['first'].str[:3].str.lower().map(DAYS.index)
+    last = entries['last'].str[:3].str.lower().map(DAYS.index, na_action='ignore').fillna(first)
+
+    text = entries['hours']
+    open_all_day = _mask(text.str.contains(OPEN_ALL_DAY))
+    closed = _mask(text.str.fullmatch(CLOSED))
+    times = text[~open_all_day & ~closed].str.replace(r'(?i)\bnoon\b', '12:00 pm', regex=True) \
+        .str.replace(r'(?i)\bmidnight\b', '12:00 am', regex=True).str.extractall(TIME)
+    times = times[times['minute'].notna() | times['meridiem'].notna()]
+    hour = times['hour'].astype(int)
+    meridiem = times['meridiem'].str.lower()
+    hour = hour.where(meridiem.isna(), hour % 12 + 12 * (meridiem == 'p'))
+    minute = times['minute'].fillna('00')
+    position = times.groupby(level=[0, 1]).cumcount()
+    closing = (position % 2 == 1).to_numpy()
+    # A range that closes at 12:00 am runs to the end of the day.
+    hour = hour.where(~(closing & (hour == 0) & (minute == '00')), 24)
+    clock = _clock(hour, minute)
+    rows, entry, pair = times.index.get_level_values(0), times.index.get_level_values(1), (position // 2).to_numpy()
+    opens = clock[~closing].set_axis(pd.MultiIndex.from_arrays([rows[~closing], entry[~closing], pair[~closing]]))
+    closes = clock[closing].set_axis(pd.MultiIndex.from_arrays([rows[closing], entry[closing], pair[closing]]))
+    ranges = (opens + '-' + closes.reindex(opens.index)).dropna()
+    value = ranges.groupby(level=[0, 1]).agg(','.join).reindex(entries.index)
+    value = value.mask(open_all_day, '00:00-24:00').mask(closed, 'closed')
+
+    columns = {}
+    for number, day in enumerate(DAYS):
+        # 'Fri - Mon' wraps around the week.
+        covers = ((first <= number) & (number <= last)) | ((first > last) & ((number >= first) | (number <= last)))
+        columns[f"hours_{day}"] = value[covers & value.notna()].groupby(level=0).first().reindex(series.index)
+    return pd.DataFrame(columns, index=series.index)
+
+
+def name_keys(series):
+    names = series.str.lower().str.replace(r"['’]", '', regex=True).str.replace('&', ' and ', regex=False)
+    return names.str.replace(NAME_NOISE, ' ', regex=True).str.strip()
+
+
+def street_keys(series):
+    return _squash(series.str.lower().str.replace(STREET_NOISE, ' ', regex=True))
+
+
+def duplicate_groups(frame):
+    # Row groups of one business: same name key and street key in one ZIP
+    # code, or same phone number in one ZIP code with the same first name word.
+    # Each row is labelled with the lowest row position of its group.
+    pd = _pandas()
+    names = _present(name_keys(frame['name']))
+    streets = _present(street_keys(frame['address_street']))
+    zips = frame['address_zip']
+    keys = [names + '|' + streets + '|' + zips,
+            frame['phone_e164'] + '|' + zips + '|' + names.str.replace(' .*', '', regex=True)]
+    # Integer codes group far faster than the strings; -1 marks a missing part.
+    codes = [pd.Series(pd.factorize(key)[0], index=frame.index) for key in keys]
+    labels = pd.Series(range(len(frame)), index=frame.index)
+    while True:
+        previous = labels
+        for code in codes:
+            lowest = labels.groupby(code).transform('min')
+            labels = lowest.where(code >= 0, labels)
+        if labels.equals(previous):
+            return labels
+
+
+def merge_duplicates(frame, labels):
+    # Like compact_csv, the first non-empty value of each column wins: the
+    # group's first row keeps its place and its gaps are filled from the rest.
+    pd = _pandas()
+    repeated = labels.duplicated(keep=False)
+    if not repeated.any():
+        return frame
+    merged = frame[repeated].groupby(labels[repeated]).first()
+    frame = frame.drop(index=labels.index[labels.duplicated()])
+    for column in merged.columns:
+        gaps = frame.loc[merged.index, column].isna().to_numpy() & merged[column].notna().to_numpy()
+        if gaps.any():
+            frame[column] = frame[column].fillna(merged.loc[gaps, column])
+    frame.index = pd.RangeIndex(len(frame))
+    return frame
+
+
+def _text(series):
+    pd = _pandas()
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Dictionary-encoded Parquet columns
+        series = series.astype(series.cat.categories.dtype)
+    # JSONL and Parquet exports write missing fields as ''.
+    return series.where(series != '')
+
+
+def normalize_frame(frame, dedup=None):
+    # Returns (normalized frame, number of rows merged into others).
+    dedup = config.NORMALIZE_DEDUP if dedup is None else dedup
+    pd = _pandas()
+    frame.index = pd.RangeIndex(len(frame))
+    for column in frame.columns:
+        if column.endswith('_rank'):
+            frame[column] = pd.to_numeric(frame[column], errors='coerce').astype('Int32')
+        elif not pd.api.types.is_numeric_dtype(frame[column]):
+            frame[column] = _text(frame[column])
+    for column in config.DFCOL_ORDER:
+        if column not in frame.columns:
+            frame[column] = pd.Series(index=frame.index, dtype=str)
+    # New columns are appended in NORMALIZED_COLUMNS order.
+    frame['phone_e164'] = e164(frame['phone'])
+    extra, frame['fax_e164'] = extra_phones(frame['extra_phones'])
+    frame['extra_phones_e164'] = extra
+    frame['email_normalized'] = emails(frame['email'])
+    parts = per_unique(frame['address'], address_parts)
+    for part in ('street', 'city', 'state', 'zip'):
+        # Back to the column's own string type (Arrow-backed where pandas uses it).
+        frame[f"address_{part}"] = parts[part].astype(frame['address'].dtype)
+    frame['category_list'] = per_unique(frame['categories'], category_lists)
+    hours = per_unique(frame['detailed_hours'], hours_columns)
+    for column in HOURS_COLUMNS:
+        frame[column] = hours[column]
+    if not dedup:
+        return frame, 0
+    rows = len(frame)
+    frame = merge_duplicates(frame, duplicate_groups(frame))
+    return frame, rows - len(frame)
+
+
+def export_parts(path):
+    # Parquet exports continue in <name>.partN.parquet files (see EXPORT_PARQUET_PART_BATCHES).
+    root, extension = os.path.splitext(path)
+    parts = sorted(glob.glob(f"{glob.escape(root)}.part*{extension}"), key=lambda part: (len(part), part))
+    return [path] + parts if extension == '.parquet' else [path]
+
+
+def _read_csv_arrow(path):
+    # pyarrow's reader is much faster than pandas' C engine. Every column is
+    # typed as string up front: read_csv(engine='pyarrow', dtype=str) infers
+    # types first and only then casts, which strips leading zeros and turns
+    # empty columns into 'None'.
+    import csv
+    import pyarrow
+    import pyarrow.csv
+    with open(path, newline='', encoding='utf-8') as f:
+        header = next(csv.reader(f), [])
+    options = pyarrow.csv.ConvertOptions(column_types={column: pyarrow.string() for column in header},
+                                         strings_can_be_null=True)
+    return pyarrow.csv.read_csv(path, convert_options=options).to_pandas()
+
+
+def read_export(path):
+    pd = _pandas()
+    extension = os.path.splitext(path)[1]
+    if extension == '.csv':
+        # Everything as text: ZIP codes and phone digits keep their leading zeros.
+        if _has_pyarrow():
+            return _read_csv_arrow(path)
+        return pd.read_csv(path, dtype=str, keep_default_na=False, na_values=[''])
+    if extension == '.jsonl':
+        return pd.read_json(path, lines=True, dtype=False)
+    if extension == '.parquet':
+        return pd.concat([pd.read_parquet(part) for part in export_parts(path)], ignore_index=True)
+    raise ValueError(f"Unknown export format: {path}")
+
+
+def write_export(frame, path):
+    extension = os.path.splitext(path)[1]
+    if extension == '.csv':
+        frame = frame.assign(**{column: frame[column].map(LIST_SEPARATOR.join, na_action='ignore')
+                                for column in ('extra_phones_e164', 'category_list')})
+        if _has_pyarrow():
+            # Many times faster than DataFrame.to_csv on a large export.
+            import pyarrow
+            import pyarrow.csv
+            pyarrow.csv.write_csv(pyarrow.Table.from_pandas(frame, preserve_index=False), f"{path}.tmp")
+        else:
+            frame.to_csv(f"{path}.tmp", index=False)
+    elif extension == '.jsonl':
+        frame.to_json(f"{path}.tmp", orient='records', lines=True, force_ascii=False)
+    elif extension == '.parquet':
+        frame.to_parquet(f"{path}.tmp", index=False)
+    else:
+        raise ValueError(f"Unknown export format: {path}")
+    os.replace(f"{path}.tmp", path)
+
+
+def normalized_path(path):
+    root, extension = os.path.splitext(path)
+    return f"{root}{config.NORMALIZED_SUFFIX}{extension}"
+
+
+def normalize_export(path, dedup=None):
+    # Writes the normalized copy of an export next to it and returns its path.
+    start = time.monotonic()
+    frame = read_export(path)
+    frame, merged = normalize_frame(frame, dedup)
+    target = normalized_path(path)
+    write_export(frame, target)
+    logging.info(f"Normalized {len(frame) + merged} rows into {target} ({merged} near-duplicates merged) "
+                 f"in {time.monotonic() - start:.1f}s")
+    return target
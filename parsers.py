@@ -0,0 +1,196 @@
+import logging
+from lxml import etree, html as lxml_html
+import config
+
+# Pure HTML -> dict functions. They run in the parse process pool, so they take
+# raw page content and return only plain, picklable data.
+
+def parse_search_page(content, query):
+    if config.PARSER_BACKEND == 'lxml':
+        try:
+            return parse_search_page_lxml(content, query)
+        except (etree.ParserError, ValueError) as e:
+            logging.warning(f"lxml extractor failed, falling back to BeautifulSoup: {e}")
+    return parse_search_page_bs(content, query)
+
+def parse_detail_page(content):
+    if config.PARSER_BACKEND == 'lxml':
+        try:
+            return parse_detail_page_lxml(content)
+        except (etree.ParserError, ValueError) as e:
+            logging.warning(f"lxml extractor failed, falling back to BeautifulSoup: {e}")
+    return parse_detail_page_bs(content)
+
+def parse_gallery_page(content):
+    if config.PARSER_BACKEND == 'lxml':
+        try:
+            return parse_gallery_page_lxml(content)
+        except (etree.ParserError, ValueError) as e:
+            logging.warning(f"lxml extractor failed, falling back to BeautifulSoup: {e}")
+    return parse_gallery_page_bs(content)
+
+# lxml backend: each page is parsed once and every field is read with an XPath
+# compiled at import time from the selector spec in config.py.
+
+def _class_xpath(tag, class_, first=True):
+    predicates = ''.join(f"[contains(concat(' ', normalize-space(@class), ' '), ' {name} ')]"
+                         for name in class_.split())
+    path = f".//{tag}{predicates}"
+    return etree.XPath(f"({path})[1]" if first else path)
+
+def _compile_fields(fields):
+    return {field: (_class_xpath(tag, class_), value, sep) for field, (tag, class_, value, sep) in fields.items()}
+
+TEXT_NODES = etree.XPath("descendant::text()[not(parent::script or parent::style)]")
+LISTING_XPATH = _class_xpath(*config.LISTING_SELECTOR, first=False)
+LISTING_FIELDS = _compile_fields(config.LISTING_FIELDS)
+DETAIL_FIELDS = _compile_fields(config.DETAIL_FIELDS)
+GALLERY_LINK_XPATH = _class_xpath(*config.GALLERY_LINK_SELECTOR)
+FOLLOW_LINKS_XPATH = etree.XPath(_class_xpath('a', 'business-name', first=False).path + '/@href')
+GALLERY_IMAGES_XPATH = etree.XPath(".//a[@data-media]/descendant::img[1]/@src")
+PARAGRAPHS_XPATH = etree.XPath(".//p")
+HOURS_ROWS_XPATH = etree.XPath("(.//table)[1]//tr[th and td]")
+
+def _text(element, sep=''):
+    # Collapse whitespace-only strings the way BeautifulSoup does, so both backends agree.
+    return sep.join(text if text.strip() else ('\n' if '\n' in text else ' ') for text in TEXT_NODES(element))
+
+def _stripped_text(element, sep=' '):
+    return sep.join(text.strip() for text in TEXT_NODES(element) if text.strip())
+
+def _field_value(element, value, sep):
+    if element is None:
+        return ''
+    if value.startswith('@'):
+        return element.get(value[1:], '')
+    if value == 'strip':
+        return _text(element, sep).strip()
+    if value == 'paragraphs':
+        paragraphs = (_stripped_text(p).replace(" :", ":") for p in PARAGRAPHS_XPATH(element))
+        return sep.join(text for text in paragraphs if text)
+    if value == 'hours':
+        return sep.join(f"{_text(row.find('th')).strip()} {_text(row.find('td')).strip()}"
+                        for row in HOURS_ROWS_XPATH(element))
+    return _text(element, sep)
+
+def _extract_fields(root, fields):
+    values = {}
+    for field, (xpath, value, sep) in fields.items():
+        matches = xpath(root)
+        values[field] = _field_value(matches[0] if matches else None, value, sep)
+    return values
+
+def parse_search_page_lxml(content, query):
+    root = lxml_html.fromstring(content)
+    return [parse_listing_lxml(item, query) for item in LISTING_XPATH(root)]
+
+def parse_listing_lxml(item, query):
+    values = _extract_fields(item, LISTING_FIELDS)
+    rank = values.pop('rank').split('.')[0]
+    if values['yp_url']:
+        values['yp_url'] = f"{config.DOMAIN}{values['yp_url']}"
+    values[f"{query}_rank"] = rank
+    return {
+        'info': values,
+        'follow_links': [href for href in FOLLOW_LINKS_XPATH(item) if "#" not in href],
+    }
+
+def parse_detail_page_lxml(content):
+    root = lxml_html.fromstring(content)
+    details = _extract_fields(root, DETAIL_FIELDS)
+    if details['email']:
+        details['email'] = details['email'].split(':')[1]
+    gallery_link = GALLERY_LINK_XPATH(root)
+    return {
+        'details': details,
+        'gallery_link': config.DOMAIN + gallery_link[0].get('href') if gallery_link else None,
+    }
+
+def parse_gallery_page_lxml(content):
+    root = lxml_html.fromstring(content)
+    return ', '.join(GALLERY_IMAGES_XPATH(root))
+
+# BeautifulSoup backend, kept as the reference implementation and fallback.
+# bs4 is only imported once a page actually goes through it.
+
+def make_soup(content):
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(content, 'lxml')
+
+def parse_search_page_bs(content, query):
+    return [parse_listing(item, query) for item in make_soup(content).find_all('div', class_='info')]
+
+def parse_listing(item, query):
+    return {
+        'info': extract_business_info(item, query),
+        'follow_links': [a['href'] for a in item.find_all('a', class_='business-name') if "#" not in a['href']],
+    }
+
+def extract_business_info(item, query):
+    business_url = f"{config.DOMAIN}{item.find('a', class_='business-name')['href']}" if item.find('a', class_='business-name') else ''
+    rank = item.find('h2', class_='n').text.split('.')[0] if item.find('h2', class_='n') else ''
+    return {
+        'name': item.find('a', class_='business-name').text if item.find('a', class_='business-name') else '',
+        'phone': item.find('div', class_='phones phone primary').text if item.find('div', class_='phones phone primary') else '',
+        'address': item.find('div', class_='adr').get_text(separator=', ') if item.find('div', class_='adr') else '',
+        'website': item.find('a', class_='track-visit-website')['href'] if item.find('a', class_='track-visit-website') else '',
+        'yp_url': business_url,
+        f"{query}_rank": rank
+    }
+
+def parse_detail_page_bs(content):
+    details_page = make_soup(content)
+    return {
+        'details': extract_business_details(details_page),
+        'gallery_link': extract_gallery_link(details_page),
+    }
+
+def extract_business_details(details_page):
+    return {
+        'slogan': get_text_or_none(details_page, "h2", class_="slogan"),
+        'general_info': get_text_or_none(details_page, "dd", class_="general-info"),
+        'neighborhood': get_text_or_none(details_page, "dd", class_="neighborhoods"),
+        'email': extract_email(details_page),
+        'extra_phones': get_text_or_none(details_page, "dd", class_="extra-phones", sep=' '),
+        'social_links': get_text_or_none(details_page, "dd", class_="social-links", sep=', '),
+        'categories': get_text_or_none(details_page, "dd", class_="categories"),
+        'hour_category': get_text_or_none(details_page, "span", class_="hour-category"),
+        'other_info': extract_other_info(details_page),
+        'detailed_hours': extract_detailed_hours(details_page)
+    }
+
+def extract_gallery_link(details_page):
+    media_thumbnail_link = details_page.find('a', class_='media-thumbnail collage-pic')
+    if media_thumbnail_link:
+        return config.DOMAIN + media_thumbnail_link['href']
+    return None
+
+def parse_gallery_page_bs(content):
+    gallery_page = make_soup(content)
+    data_media_links = gallery_page.find_all('a', attrs={'data-media': True})
+    image_urls = [link.find('img')['src'] for link in data_media_links if link.find('img')]
+    return ', '.join(image_urls)
+
+def get_text_or_none(soup, tag, class_=None, sep=''):
+    element = soup.find(tag, class_=class_)
+    if element:
+        return element.get_text(separator=sep).strip()
+    return ''
+
+def extract_email(details_page):
+    email_element = details_page.find('a', class_='email-business')
+    return email_element.get('href').split(':')[1] if email_element else ''
+
+def extract_other_info(details_page):
+    other_info_dd = details_page.find("dd", class_="other-information")
+    if other_info_dd:
+        return ', '.join([p.get_text(separator=' ', strip=True).replace(" :", ":")
+                          for p in other_info_dd.find_all('p') if p.get_text(strip=True)])
+    return ''
+
+def extract_detailed_hours(details_page):
+    hours_div = details_page.find('div', class_='open-details')
+    if hours_div and (hours_table := hours_div.find('table')):
+        return ', '.join([f"{row.find('th').get_text().strip()} {row.find('td').get_text().strip()}"
+                          for row in hours_table.find_all('tr') if row.find('th') and row.find('td')])
+    return ''
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+import config
+
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        seconds = (retry_at - datetime.now(timezone.utc)).total_seconds()
+    return min(max(seconds, 0), config.RETRY_AFTER_MAX)
+
+
+def backoff_delay(attempt):
+    # Full jitter: uniform over [0, base * 2^attempt], capped.
+    return random.uniform(0, min(config.RETRY_BACKOFF_MAX, config.RETRY_BACKOFF_BASE * 2 ** attempt))
+
+
+class HostBucket:
+    # Token bucket whose refill rate follows AIMD: it creeps up while responses
+    # are fast and healthy and is cut multiplicatively on throttling, errors or
+    # slow responses (at most once per cooldown so one burst of failures from
+    # concurrent requests only counts once).
+    def __init__(self, host):
+        self.host = host
+        self.rate = config.RATE_LIMIT_INITIAL
+        self.tokens = config.RATE_LIMIT_BURST
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0
+        self.last_decrease = 0
+        self.lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(config.RATE_LIMIT_BURST, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def increase(self):
+        self.rate = min(config.RATE_LIMIT_MAX, self.rate + config.RATE_LIMIT_INCREASE / self.rate)
+
+    def decrease(self, reason):
+        now = time.monotonic()
+        if now - self.last_decrease < config.RATE_LIMIT_COOLDOWN:
+            return
+        self.last_decrease = now
+        self.rate = max(config.RATE_LIMIT_MIN, self.rate * config.RATE_LIMIT_DECREASE)
+        logging.info(f"Throttling {self.host} to {self.rate:.2f} req/s ({reason})")
+
+    def block(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class AdaptiveRateLimiter:
+    def __init__(self):
+        self._buckets = {}
+
+    def bucket(self, url):
+        host = urlparse(url).netloc
+        if host not in self._buckets:
+            self._buckets[host] = HostBucket(host)
+        return self._buckets[host]
+
+    async def acquire(self, url):
+        await self.bucket(url).acquire()
+
+    def record_success(self, url, latency):
+        bucket = self.bucket(url)
+        if latency > config.RATE_LIMIT_LATENCY_TARGET:
+            bucket.decrease(f"latency {latency:.1f}s")
+        else:
+            bucket.increase()
+
+    def record_throttle(self, url, status, retry_after=None):
+        bucket = self.bucket(url)
+        bucket.decrease(f"HTTP {status}")
+        if retry_after:
+            bucket.block(retry_after)
+
+    def record_error(self, url, error):
+        self.bucket(url).decrease(type(error).__name__)
+
+    def rates(self):
+        return {host: bucket.rate for host, bucket in self._buckets.items()}
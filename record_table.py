@@ -0,0 +1,143 @@
+import csv
+import sys
+from array import array
+import config
+
+RANK_SUFFIX = '_rank'
+
+
+def is_rank(column):
+    return column.endswith(RANK_SUFFIX)
+
+
+def rank_value(value):
+    # '12' -> 12; missing or malformed ranks -> None.
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def arrow_schema(columns):
+    # int32 ranks, dictionary-encoded interned fields, strings otherwise.
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError("Arrow export requires pyarrow (pip install pyarrow)")
+    fields = []
+    for column in columns:
+        if is_rank(column):
+            fields.append((column, pa.int32()))
+        elif column in config.RECORD_INTERNED_FIELDS:
+            fields.append((column, pa.dictionary(pa.int32(), pa.string())))
+        else:
+            fields.append((column, pa.string()))
+    return pa.schema(fields)
+
+
+def intern_fields(record):
+    # Parsed pages arrive pickled from the parse pool with fresh copies of
+    # strings like the category list; share one copy per distinct value.
+    for key in config.RECORD_INTERNED_FIELDS & record.keys():
+        if isinstance(record[key], str):
+            record[key] = sys.intern(record[key])
+    return record
+
+
+def fold_record(merged, record):
+    # Non-empty values win, as in RecordTable.add: a later listing-only
+    # sighting of a business never blanks out its detail fields.
+    for key, value in record.items():
+        if value is not None and value != '':
+            merged[key] = value
+        else:
+            merged.setdefault(key, value)
+    return merged
+
+
+class RecordTable:
+    # Column-oriented accumulator for finished business records. Every field is
+    # one list, values of the low-cardinality RECORD_INTERNED_FIELDS are
+    # interned, and the '{query}_rank' keys become int32 columns
+    # (business x query, 0 = not ranked). Rows are keyed on (name, address);
+    # adding a record that is already present folds it in the way
+    # fold_record does.
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.values = {column: [] for column in self.columns if not is_rank(column)}
+        self.ranks = {column: array('i') for column in self.columns if is_rank(column)}
+        self.index = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def _row(self, unique_id):
+        row = self.index.get(unique_id)
+        if row is None:
+            row = self.index[unique_id] = len(self.index)
+            for values in self.values.values():
+                values.append(None)
+            for ranks in self.ranks.values():
+                ranks.append(0)
+        return row
+
+    def _add_column(self, column):
+        self.columns.append(column)
+        if is_rank(column):
+            self.ranks[column] = array('i', [0]) * len(self.index)
+        else:
+            self.values[column] = [None] * len(self.index)
+
+    def add(self, record):
+        row = self._row((record.get('name'), record.get('address')))
+        interned = config.RECORD_INTERNED_FIELDS
+        for column, value in record.items():
+            if value is None or value == '':
+                continue
+            if column not in self.values and column not in self.ranks:
+                self._add_column(column)
+            ranks = self.ranks.get(column)
+            if ranks is not None:
+                ranks[row] = rank_value(value) or 0
+            elif column in interned and isinstance(value, str):
+                self.values[column][row] = sys.intern(value)
+            else:
+                self.values[column][row] = value
+
+    def to_arrow(self, columns=None):
+        # Columns go to Arrow as whole arrays: int32 ranks with 0 as null,
+        # interned fields dictionary-encoded.
+        import pyarrow as pa
+        schema = arrow_schema(columns or self.columns)
+        arrays = []
+        for field in schema:
+            if field.name in self.ranks:
+                arrays.append(pa.array([rank or None for rank in self.ranks[field.name]], type=field.type))
+            else:
+                values = self.values.get(field.name) or [None] * len(self)
+                strings = pa.array(values, type=pa.string())
+                arrays.append(strings.dictionary_encode() if pa.types.is_dictionary(field.type) else strings)
+        return pa.Table.from_arrays(arrays, schema=schema)
+
+    def _record(self, row):
+        record = {}
+        for column in self.columns:
+            ranks = self.ranks.get(column)
+            record[column] = self.values[column][row] if ranks is None else ranks[row] or None
+        return record
+
+    def get(self, unique_id):
+        row = self.index.get(unique_id)
+        return None if row is None else self._record(row)
+
+    def rows(self):
+        for row in range(len(self.index)):
+            yield self._record(row)
+
+    def write_csv(self, path):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=self.columns)
+            writer.writeheader()
+            writer.writerows(self.rows())
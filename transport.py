@@ -0,0 +1,227 @@
+import asyncio
+import itertools
+import logging
+import time
+import config
+
+# httpx logs every request at INFO, one line per page over the progress bar.
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+
+
+def accept_encoding():
+    # Brotli is only offered when a decoder is installed; aiohttp cannot
+    # decode 'br' bodies without one.
+    if not config.HTTP_COMPRESSION:
+        return 'identity'
+    for module in ('brotli', 'brotlicffi'):
+        try:
+            __import__(module)
+            return 'gzip, deflate, br'
+        except ImportError:
+            pass
+    return 'gzip, deflate'
+
+
+def default_headers():
+    return {'User-Agent': config.USER_AGENT, 'Accept-Encoding': accept_encoding()}
+
+
+def range_headers(offset):
+    # Downloads are never content-encoded so that byte offsets into the
+    # partial file line up with the resource.
+    headers = {'Accept-Encoding': 'identity'}
+    if offset:
+        headers['Range'] = f'bytes={offset}-'
+    return headers
+
+
+class ProxyPool:
+    # Round-robin over the configured proxies. A proxy that fails to connect
+    # sits out HTTP_PROXY_COOLDOWN seconds; when every proxy is cooling down
+    # the one that comes back first is used anyway.
+    def __init__(self, proxies, cooldown=None):
+        self.proxies = list(proxies)
+        self.cooldown = config.HTTP_PROXY_COOLDOWN if cooldown is None else cooldown
+        self.benched = {}
+        self._cycle = itertools.cycle(self.proxies)
+
+    def next(self):
+        if not self.proxies:
+            return None
+        now = time.monotonic()
+        for _ in range(len(self.proxies)):
+            proxy = next(self._cycle)
+            if self.benched.get(proxy, 0) <= now:
+                return proxy
+        return min(self.proxies, key=lambda proxy: self.benched[proxy])
+
+    def record_failure(self, proxy):
+        if proxy is not None:
+            logging.warning(f"Benching proxy {proxy} for {self.cooldown}s")
+            self.benched[proxy] = time.monotonic() + self.cooldown
+
+
+def load_proxies():
+    proxies = list(config.HTTP_PROXIES)
+    if config.HTTP_PROXY_FILE:
+        try:
+            with open(config.HTTP_PROXY_FILE, 'r') as file:
+                proxies.extend(line.strip() for line in file if line.strip())
+        except IOError as e:
+            logging.error(f"Error reading proxy file {config.HTTP_PROXY_FILE}: {e}")
+    return ProxyPool(proxies)
+
+
+class Response:
+    # The parts of a response fetch_url needs, whichever client produced it.
+    # wire_bytes is the size as transferred, before decompression, when the
+    # server says so.
+    __slots__ = ('status', 'headers', 'body', 'wire_bytes')
+
+    def __init__(self, status, headers, body, wire_bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.wire_bytes = wire_bytes
+
+
+def _wire_bytes(headers, decoded_bytes):
+    try:
+        return int(headers['Content-Length'])
+    except (KeyError, ValueError):
+        return decoded_bytes
+
+
+class Client:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class AiohttpClient(Client):
+    # HTTP/1.1 keep-alive pool: aiohttp's connector with explicit pool
+    # limits, DNS caching and timeouts so a stalled server cannot hold a
+    # worker forever.
+    def __init__(self, proxies):
+        import aiohttp
+        self.aiohttp = aiohttp
+        self.errors = (aiohttp.ClientError, asyncio.TimeoutError)
+        self.proxies = proxies
+        connector = aiohttp.TCPConnector(
+            limit=config.HTTP_POOL_LIMIT,
+            limit_per_host=config.HTTP_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=config.HTTP_DNS_CACHE_SECONDS,
+            use_dns_cache=config.HTTP_DNS_CACHE_SECONDS is not None,
+            keepalive_timeout=config.HTTP_KEEPALIVE_SECONDS,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=config.HTTP_TIMEOUT_TOTAL,
+            sock_connect=config.HTTP_TIMEOUT_CONNECT,
+            sock_read=config.HTTP_TIMEOUT_READ,
+        )
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout, headers=default_headers())
+
+    async def get(self, url, headers=None):
+        proxy = self.proxies.next()
+        try:
+            async with self.session.get(url, headers=headers, proxy=proxy) as response:
+                body = await response.text() if response.status < 300 else ''
+                return Response(response.status, response.headers, body,
+                                _wire_bytes(response.headers, response.content.total_bytes))
+        except self.aiohttp.ClientConnectionError:
+            self.proxies.record_failure(proxy)
+            raise
+
+    async def download(self, url, file, offset=0):
+        # Streams the body into file, asking for the bytes from offset on; a
+        # server that ignores the range answers 200 and the file starts over.
+        proxy = self.proxies.next()
+        try:
+            async with self.session.get(url, headers=range_headers(offset), proxy=proxy) as response:
+                if response.status == 200:
+                    file.truncate(0)
+                if response.status in (200, 206):
+                    async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_BYTES):
+                        file.write(chunk)
+                return response.status
+        except self.aiohttp.ClientConnectionError:
+            self.proxies.record_failure(proxy)
+            raise
+
+    async def close(self):
+        await self.session.close()
+
+
+class HttpxClient(Client):
+    # HTTP/2 through httpx: requests to one host are multiplexed over a few
+    # connections. httpx takes one proxy per client, so proxy rotation keeps
+    # a client per proxy. DNS caching is left to the system resolver.
+    def __init__(self, proxies):
+        try:
+            import httpx
+        except ImportError:
+            raise ImportError("HTTP_CLIENT = 'httpx' requires httpx (pip install 'httpx[http2]')")
+        self.httpx = httpx
+        self.errors = (httpx.TransportError, asyncio.TimeoutError)
+        self.proxies = proxies
+        self.clients = {}
+        self.limits = httpx.Limits(max_connections=config.HTTP_POOL_LIMIT or None,
+                                   max_keepalive_connections=config.HTTP_POOL_LIMIT_PER_HOST or None,
+                                   keepalive_expiry=config.HTTP_KEEPALIVE_SECONDS)
+        # HTTP_TIMEOUT_TOTAL is enforced around each request instead.
+        self.timeout = httpx.Timeout(connect=config.HTTP_TIMEOUT_CONNECT, read=config.HTTP_TIMEOUT_READ,
+                                     write=config.HTTP_TIMEOUT_READ, pool=None)
+
+    def _client(self, proxy):
+        client = self.clients.get(proxy)
+        if client is None:
+            client = self.clients[proxy] = self.httpx.AsyncClient(
+                http2=True, limits=self.limits, timeout=self.timeout, proxy=proxy,
+                headers=default_headers())
+        return client
+
+    async def get(self, url, headers=None):
+        proxy = self.proxies.next()
+        try:
+            response = await asyncio.wait_for(self._client(proxy).get(url, headers=headers),
+                                              config.HTTP_TIMEOUT_TOTAL)
+        except (self.httpx.ConnectError, self.httpx.ProxyError):
+            self.proxies.record_failure(proxy)
+            raise
+        body = response.text if response.status_code < 300 else ''
+        return Response(response.status_code, response.headers, body, response.num_bytes_downloaded)
+
+    async def download(self, url, file, offset=0):
+        proxy = self.proxies.next()
+
+        async def stream():
+            async with self._client(proxy).stream('GET', url, headers=range_headers(offset)) as response:
+                if response.status_code == 200:
+                    file.truncate(0)
+                if response.status_code in (200, 206):
+                    async for chunk in response.aiter_raw(DOWNLOAD_CHUNK_BYTES):
+                        file.write(chunk)
+                return response.status_code
+        try:
+            return await asyncio.wait_for(stream(), config.HTTP_TIMEOUT_TOTAL)
+        except (self.httpx.ConnectError, self.httpx.ProxyError):
+            self.proxies.record_failure(proxy)
+            raise
+
+    async def close(self):
+        for client in self.clients.values():
+            await client.aclose()
+
+
+CLIENTS = {'aiohttp': AiohttpClient, 'httpx': HttpxClient}
+
+
+def open_client(kind=None):
+    kind = config.HTTP_CLIENT if kind is None else kind
+    if kind not in CLIENTS:
+        raise ValueError(f"Unknown HTTP client: {kind}")
+    return CLIENTS[kind](load_proxies())
@@ -0,0 +1,216 @@
+import json
+import os
+import socket
+import sqlite3
+import time
+import config
+import record_table
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class BatchCollector:
+    # Stands in for an export writer on a worker: records released by the
+    # scheduler are kept until the batch is pushed to the store. A business
+    # released twice (found again by another query) is folded into one record.
+    def __init__(self):
+        self.by_key = {}
+        self.rows_written = 0
+
+    @property
+    def records(self):
+        return list(self.by_key.values())
+
+    def write(self, record):
+        key = (record.get('name'), record.get('address'))
+        record_table.fold_record(self.by_key.setdefault(key, {}), record)
+        self.rows_written += 1
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class WorkStore:
+    # Shared queue of city batches for --coordinator/--worker crawls. Workers
+    # lease a batch, extend the lease with heartbeats and push the finished
+    # records back; a lease that runs out is handed to the next worker. Every
+    # method is a short transaction, so any number of processes on one host
+    # can use the same database. Not across machines: WAL mode needs shared
+    # memory, so the file cannot live on a network filesystem.
+    def __init__(self, path=None, lease_seconds=None):
+        path = config.WORK_STORE_PATH if path is None else path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.lease_seconds = config.WORK_LEASE_SECONDS if lease_seconds is None else lease_seconds
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS batches (
+                id INTEGER PRIMARY KEY,
+                cities TEXT NOT NULL,
+                status TEXT NOT NULL,
+                worker TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS batches_status ON batches (status);
+            CREATE TABLE IF NOT EXISTS workers (
+                worker TEXT PRIMARY KEY,
+                started_at REAL NOT NULL,
+                heartbeat_at REAL NOT NULL,
+                batch_id INTEGER,
+                batches_done INTEGER NOT NULL DEFAULT 0,
+                records INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS results (
+                batch_id INTEGER NOT NULL,
+                unique_id TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (unique_id, batch_id)
+            );
+        ''')
+
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can never
+        # both see the same batch as free.
+        self.conn.execute('BEGIN IMMEDIATE')
+
+    def seed(self, meta, batches):
+        # Replaces any previous run in one transaction, so a worker never sees
+        # the new run's settings without its batches.
+        now = time.time()
+        self._transaction()
+        try:
+            for table in ('meta', 'batches', 'workers', 'results'):
+                self.conn.execute(f'DELETE FROM {table}')
+            self.conn.executemany('INSERT INTO meta VALUES (?, ?)', ((key, json.dumps(value)) for key, value in meta.items()))
+            self.conn.executemany('INSERT INTO batches (cities, status, updated_at) VALUES (?, ?, ?)',
+                                  ((json.dumps(cities), PENDING, now) for cities in batches))
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        self.conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, json.dumps(value)))
+
+    def lease(self, worker, max_attempts=None):
+        max_attempts = config.WORK_MAX_ATTEMPTS if max_attempts is None else max_attempts
+        now = time.time()
+        self._transaction()
+        try:
+            # Batches whose worker stopped heartbeating go back to the pool.
+            self.conn.execute('''
+                UPDATE batches SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, worker = NULL
+                WHERE status = ? AND lease_expires < ?
+            ''', (max_attempts, FAILED, PENDING, LEASED, now))
+            row = self.conn.execute('SELECT id, cities FROM batches WHERE status = ? ORDER BY id LIMIT 1',
+                                    (PENDING,)).fetchone()
+            if row is not None:
+                self.conn.execute('''
+                    UPDATE batches SET status = ?, worker = ?, lease_expires = ?, attempts = attempts + 1,
+                        updated_at = ?
+                    WHERE id = ?
+                ''', (LEASED, worker, now + self.lease_seconds, now, row[0]))
+            self.conn.execute('''
+                INSERT INTO workers (worker, started_at, heartbeat_at, batch_id) VALUES (?, ?, ?, ?)
+                ON CONFLICT (worker) DO UPDATE SET heartbeat_at = excluded.heartbeat_at, batch_id = excluded.batch_id
+            ''', (worker, now, now, row[0] if row else None))
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return (row[0], json.loads(row[1])) if row else None
+
+    def heartbeat(self, worker, batch_id):
+        # Returns False once the lease was lost (expired and taken over).
+        now = time.time()
+        self.conn.execute('UPDATE workers SET heartbeat_at = ? WHERE worker = ?', (now, worker))
+        cursor = self.conn.execute('''
+            UPDATE batches SET lease_expires = ? WHERE id = ? AND worker = ? AND status = ?
+        ''', (now + self.lease_seconds, batch_id, worker, LEASED))
+        return cursor.rowcount == 1
+
+    def complete(self, worker, batch_id, records):
+        # Results only count if this worker still holds the lease; a batch that
+        # was re-leased after a stall is finished by its new owner. Records
+        # sharing a key are folded first so no row is replaced by a partial one.
+        folded = {}
+        for record in records:
+            key = json.dumps([record.get('name'), record.get('address')])
+            record_table.fold_record(folded.setdefault(key, {}), record)
+        self._transaction()
+        try:
+            cursor = self.conn.execute('''
+                UPDATE batches SET status = ?, lease_expires = NULL, updated_at = ?
+                WHERE id = ? AND worker = ? AND status = ?
+            ''', (DONE, time.time(), batch_id, worker, LEASED))
+            if cursor.rowcount != 1:
+                self.conn.execute('ROLLBACK')
+                return False
+            self.conn.executemany('INSERT INTO results VALUES (?, ?, ?)', (
+                (batch_id, key, json.dumps(record, ensure_ascii=False)) for key, record in folded.items()))
+            self.conn.execute('''
+                UPDATE workers SET batches_done = batches_done + 1, records = records + ?, batch_id = NULL
+                WHERE worker = ?
+            ''', (len(folded), worker))
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return True
+
+    def abandon(self, worker, batch_id):
+        self.conn.execute('''
+            UPDATE batches SET status = ?, worker = NULL, lease_expires = NULL, updated_at = ?
+            WHERE id = ? AND worker = ? AND status = ?
+        ''', (PENDING, time.time(), batch_id, worker, LEASED))
+
+    def batch_counts(self):
+        return dict(self.conn.execute('SELECT status, COUNT(*) FROM batches GROUP BY status').fetchall())
+
+    def unfinished(self):
+        counts = self.batch_counts()
+        return counts.get(PENDING, 0) + counts.get(LEASED, 0)
+
+    def live_workers(self, within=None):
+        since = time.time() - (within or self.lease_seconds)
+        return self.conn.execute('SELECT COUNT(*) FROM workers WHERE heartbeat_at >= ?', (since,)).fetchone()[0]
+
+    def merged_records(self):
+        # One record per (name, address), later batches folded over earlier
+        # ones with fold_record. Rows come sorted by key, so
+        # only one business is held in memory at a time.
+        current_key, merged = None, None
+        for key, data in self.conn.execute('SELECT unique_id, data FROM results ORDER BY unique_id, batch_id'):
+            if key != current_key:
+                if merged is not None:
+                    yield merged
+                current_key, merged = key, {}
+            record_table.fold_record(merged, json.loads(data))
+        if merged is not None:
+            yield merged
+
+    def close(self):
+        self.conn.close()